@@ -1,10 +1,23 @@
+import hashlib
+import json
 import logging
-from fileinput import filename
+import os
+import posixpath
+import shutil
+import sys
+import tarfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
 
 import click
-
-from gammapy.scripts.download import progress_download
+import requests
+from tqdm import tqdm
 
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -12,173 +25,704 @@ logging.basicConfig(level=logging.INFO)
 BASE_URL = "https://github.com/gammapy/gammapy-data/raw/v1.0/"
 PATH = Path(__file__).parent.parent
 PATH_DATA = PATH / "src/data/input"
+MANIFEST_FILE = Path(__file__).parent / "download-manifest.json"
+REGISTRY_FILE = Path(__file__).parent / "download-registry.json"
+PATH_CHECKSUMS = PATH_DATA / ".checksums"
+
+N_JOBS = 4
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 60
+RETRIES = 3
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+# Linux ioctl request number to clone a file as copy-on-write reflink
+FICLONE = 0x40049409
+
+
+class DownloadProgress:
+    """Aggregate progress bar shared by all download workers"""
+
+    def __init__(self, n_files):
+        self.n_files = n_files
+        self.n_done = 0
+        self._lock = threading.Lock()
+        self._bar = tqdm(total=0, unit="B", unit_scale=True, unit_divisor=1024)
+        self._bar.set_postfix_str(f"files 0/{n_files}")
 
+    def add_total(self, size):
+        with self._lock:
+            self._bar.total += size
+            self._bar.refresh()
+
+    def update(self, size):
+        with self._lock:
+            self._bar.update(size)
+
+    def file_done(self):
+        with self._lock:
+            self.n_done += 1
+            self._bar.set_postfix_str(f"files {self.n_done}/{self.n_files}")
+
+    def close(self):
+        self._bar.close()
+
+
+def sha256sum(path):
+    """Compute the SHA256 hex digest of a file"""
+    checksum = hashlib.sha256()
+
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+class ChecksumCache:
+    """Cache of file checksums, keyed by filename, size and modification time
+
+    Avoids re-hashing files which have not changed since they were last
+    verified, so repeated integrity checks only cost a ``stat`` per file.
+    Each checksum is stored in its own small JSON file, so download jobs
+    run in parallel, e.g. by Snakemake, never write to the same file.
+
+    Files without a manifest entry are recorded after a complete download,
+    see `ChecksumCache.record`, and later checked against that record.
+    """
+
+    def __init__(self, path=PATH_CHECKSUMS):
+        self.path = Path(path)
+
+    def filename(self, key):
+        return self.path / f"{key}.json"
+
+    def _read(self, key):
+        try:
+            return json.loads(self.filename(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, data):
+        filename = self.filename(key)
+        filename.parent.mkdir(exist_ok=True, parents=True)
+        tmp = filename.with_name(f"{filename.name}.{os.getpid()}")
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, filename)
+
+    def sha256(self, path):
+        stat = path.stat()
+        key = str(path.relative_to(PATH_DATA))
+        cached = self._read(key)
+
+        if cached and cached["size"] == stat.st_size:
+            if cached["mtime_ns"] == stat.st_mtime_ns:
+                return cached["sha256"]
+
+        sha256 = sha256sum(path)
+        data = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+        self._write(key, data)
+        return sha256
+
+    def record(self, path):
+        """Record the checksum of a complete download"""
+        stat = path.stat()
+        data = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256sum(path),
+            "downloaded": True,
+        }
+        self._write(str(path.relative_to(PATH_DATA)), data)
+
+    def get_record(self, path):
+        """Download record of a file, None if missing or the file changed since"""
+        stat = path.stat()
+        cached = self._read(str(path.relative_to(PATH_DATA)))
+
+        if not cached or not cached.get("downloaded"):
+            return None
+
+        if (cached["size"], cached["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+            return None
+
+        return cached
+
+
+def read_registry(filename=REGISTRY_FILE):
+    """Read the mapping of dataset names to their files"""
+    return json.loads(filename.read_text())
+
+
+def read_manifest(filename=MANIFEST_FILE):
+    """Read the per-dataset manifest of file sizes and SHA256 checksums"""
+    if not filename.exists():
+        return {}
+
+    return json.loads(filename.read_text())
+
+
+def verify_file(filename, manifest, checksums, strict=False):
+    """Verify a local data file against its manifest entry
+
+    Returns ``True`` only if the file exists and its size and SHA256
+    checksum match the manifest. A file without a manifest entry is valid
+    if it did not change since its download was recorded, with ``strict``
+    its checksum is computed again and compared to the record.
+    """
+    path = PATH_DATA / filename
+    entry = manifest.get(filename)
+
+    if not path.exists():
+        return False
+
+    if entry is None:
+        record = checksums.get_record(path)
+
+        if record is None:
+            return False
+
+        return not strict or sha256sum(path) == record["sha256"]
+
+    if path.stat().st_size != entry["size"]:
+        return False
+
+    return checksums.sha256(path) == entry["sha256"]
+
+
+def get_total_size(response):
+    """Size of the complete file from the response headers, None if unknown"""
+    if response.headers.get("content-encoding", "identity") != "identity":
+        # the content length refers to the encoded transfer
+        return None
+
+    if response.status_code == 206:
+        size = response.headers.get("content-range", "").rpartition("/")[-1]
+    else:
+        size = response.headers.get("content-length", "")
+
+    return int(size) if size.isdigit() else None
+
+
+def _download_part(source, part, progress, first_attempt):
+    """Download into a ``.part`` file, resuming from its current size
+
+    Raises a `~requests.ConnectionError` if the ``.part`` file does not have
+    the size announced by the server after the transfer, so truncated
+    responses are retried.
+    """
+    offset = part.stat().st_size if part.exists() else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    response = requests.get(source, stream=True, timeout=TIMEOUT, headers=headers)
+
+    with response:
+        if response.status_code == 416:
+            # range not satisfiable, the part file is complete or invalid
+            size = response.headers.get("content-range", "").rpartition("/")[-1]
+            if size.isdigit() and int(size) == offset:
+                return
+            part.unlink()
+            raise requests.ConnectionError(f"Invalid partial download {part}")
+
+        response.raise_for_status()
+
+        if response.status_code != 206:
+            # server ignored the range request, start from scratch
+            if offset and not first_attempt:
+                progress.update(-offset)
+            offset = 0
+
+        total = get_total_size(response)
+
+        if first_attempt:
+            progress.add_total(total or 0)
+            progress.update(offset)
+
+        if offset:
+            log.info(f"Resuming {source} at byte {offset}")
+
+        with part.open("ab" if offset else "wb") as fh:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                fh.write(chunk)
+                progress.update(len(chunk))
+
+    size = part.stat().st_size
+
+    if total is not None and size != total:
+        if size > total:
+            # corrupt part file, count the bytes again on the next attempt
+            progress.update(-size)
+            part.unlink()
+
+        raise requests.ConnectionError(
+            f"Incomplete download of {source}: {size} of {total} bytes"
+        )
+
+
+def download_file(source, destination, progress, retries=RETRIES):
+    """Download a single file, resuming interrupted transfers
+
+    Data is written to a ``.part`` file next to the destination, which is
+    atomically renamed once the transfer is complete, so the destination
+    never exists in a truncated state. A transfer is complete once the
+    ``.part`` file has the size given by the ``Content-Range`` or
+    ``Content-Length`` header. Transient connection errors and truncated
+    responses are retried with exponential backoff, continuing via HTTP
+    range requests.
+    """
+    destination.parent.mkdir(exist_ok=True, parents=True)
+    part = destination.with_name(destination.name + ".part")
+    log.debug(f"Downloading {source}")
+
+    for attempt in range(retries + 1):
+        try:
+            _download_part(source, part, progress, first_attempt=attempt == 0)
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as error:
+            if attempt == retries:
+                raise
+
+            delay = 2**attempt
+            log.warning(f"{error}, retrying {source} in {delay} s")
+            time.sleep(delay)
+
+    os.replace(part, destination)
+
+
+def reflink(source, destination):
+    """Create a copy-on-write clone of a file, if the filesystem supports it"""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("Reflinks are not supported on this platform")
+
+    with source.open("rb") as src, destination.open("wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def link_or_copy(source, destination):
+    """Stage a file by hard-link, reflink or, as a last resort, copy"""
+    tmp = destination.with_name(destination.name + ".part")
+    tmp.unlink(missing_ok=True)
+
+    try:
+        os.link(source, tmp)
+    except OSError:
+        try:
+            reflink(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+
+    os.replace(tmp, destination)
+
+
+class DataSource(ABC):
+    """Base class for data sources
+
+    Sub-classes implement `fetch` for a single file; by default files are
+    fetched concurrently with a bounded pool of worker threads.
+    """
+
+    @abstractmethod
+    def fetch(self, filename, destination, progress):
+        """Fetch a single file to its destination"""
+
+    def fetch_files(self, filenames, progress, n_jobs=N_JOBS, on_done=None):
+        """Fetch files concurrently, stop at the first failure
+
+        Parameters
+        ----------
+        filenames : list of str
+            Filenames relative to the data root.
+        progress : `DownloadProgress`
+            Progress bar.
+        n_jobs : int
+            Maximum number of concurrent fetches.
+        on_done : callable
+            Called with the filename as soon as a file is fetched, e.g. to
+            verify it. Exceptions raised by it stop the remaining fetches.
+        """
+        executor = ThreadPoolExecutor(max_workers=n_jobs)
+
+        futures = {}
+        for filename in filenames:
+            destination = PATH_DATA / filename
+            destination.parent.mkdir(exist_ok=True, parents=True)
+            future = executor.submit(self.fetch, filename, destination, progress)
+            futures[future] = filename
+
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    log.error(f"Fetching {futures[future]} failed")
+                    raise
+
+                if on_done is not None:
+                    on_done(futures[future])
+
+                progress.file_done()
+        finally:
+            # do not start pending downloads once one has failed
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class HTTPSource(DataSource):
+    """Download files from an HTTP(S) server, e.g. GitHub or a test server"""
+
+    def __init__(self, base_url=BASE_URL, retries=RETRIES):
+        self.base_url = base_url.rstrip("/") + "/"
+        self.retries = retries
+
+    def __str__(self):
+        return self.base_url
+
+    def fetch(self, filename, destination, progress):
+        source = self.base_url + filename
+        download_file(source, destination, progress, retries=self.retries)
 
-FILENAMES_FERMI_3FHL_GC = [
-    "fermi-3fhl-gc/fermi-3fhl-gc-counts-cube.fits.gz",
-    "fermi-3fhl-gc/fermi-3fhl-gc-background-cube.fits.gz",
-    "fermi-3fhl-gc/fermi-3fhl-gc-exposure-cube.fits.gz",
-    "fermi-3fhl-gc/fermi-3fhl-gc-psf-cube.fits.gz",
-]
-
-FILENAMES_FERMI_CATALOG = ["catalogs/fermi/gll_psc_v28.fit.gz"]
-
-FILENAMES_EBL = ["ebl/ebl_dominguez11.fits.gz"]
-
-FILENAMES_FERMI_3FHL_CRAB = [
-    "fermi-3fhl-crab/Fermi-LAT-3FHL_data_Fermi-LAT.fits",
-    "fermi-3fhl-crab/Fermi-LAT-3FHL_iem.fits",
-    "fermi-3fhl-crab/Fermi-LAT-3FHL_datasets.yaml",
-    "fermi-3fhl-crab/Fermi-LAT-3FHL_models.yaml",
-]
-
-FILENAMES_MAGIC = [
-    "magic/rad_max/data/hdu-index.fits.gz",
-    "magic/rad_max/data/obs-index.fits.gz",
-    "magic/rad_max/data/20131004_05029747_DL3_CrabNebula-W0.40+035.fits",
-    "magic/rad_max/data/20131004_05029748_DL3_CrabNebula-W0.40+215.fits",
-]
-
-FILENAMES_HAWC = [
-    "hawc_crab/HAWC19_flux_points.fits",
-]
-
-FILENAMES_HAWC_DL3 = [
-    "hawc/crab_events_pass4/hdu-index-table-GP-Crab.fits.gz",
-    "hawc/crab_events_pass4/obs-index-table-GP-Crab.fits.gz",
-    "hawc/crab_events_pass4/irfs/EffectiveAreaMap_Crab_fHitbin5GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/EffectiveAreaMap_Crab_fHitbin6GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/EffectiveAreaMap_Crab_fHitbin7GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/EffectiveAreaMap_Crab_fHitbin8GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/EffectiveAreaMap_Crab_fHitbin9GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/PSFMap_Crab_fHitbin5GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/PSFMap_Crab_fHitbin6GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/PSFMap_Crab_fHitbin7GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/PSFMap_Crab_fHitbin8GP.fits.gz",
-    "hawc/crab_events_pass4/irfs/PSFMap_Crab_fHitbin9GP.fits.gz",
-]
-
-
-FILENAMES_CTA = [
-    "cta-1dc/index/gps/hdu-index.fits.gz",
-    "cta-1dc/index/gps/obs-index.fits.gz",
-    "cta-1dc/data/baseline/gps/gps_baseline_110380.fits",
-    "cta-1dc/data/baseline/gps/gps_baseline_111140.fits",
-    "cta-1dc/data/baseline/gps/gps_baseline_111159.fits",
-    "cta-1dc/caldb/data/cta/1dc/bcf/South_z20_50h/irf_file.fits",
-    "cta-1dc-gc/cta-1dc-gc.fits.gz",
-]
-
-OBS_IDS_HESS_DR1 = [
-    33787,
-    33788,
-    33789,
-    33790,
-    33791,
-    33792,
-    33793,
-    33794,
-    33795,
-    33796,
-    33797,
-    33798,
-    33799,
-    33800,
-    33801,
-    23523,
-    23526,
-    23559,
-    23592,
-]
-
-FILENAMES_HESS_DR1 = [
-    "hess-dl3-dr1/obs-index.fits.gz",
-    "hess-dl3-dr1/hdu-index.fits.gz",
-    "joint-crab/spectra/hess/pha_obs23523.fits",
-    "joint-crab/spectra/hess/arf_obs23523.fits",
-    "joint-crab/spectra/hess/rmf_obs23523.fits",
-    "joint-crab/spectra/hess/bkg_obs23523.fits",
-]
-
-
-for obs_id in OBS_IDS_HESS_DR1:
-    filename = f"hess-dl3-dr1/data/hess_dl3_dr1_obs_id_0{obs_id}.fits.gz"
-    FILENAMES_HESS_DR1.append(filename)
-
-
-def download_data_files(filenames):
-    for filename in filenames:
-        destination = PATH_DATA / filename
-        destination.parent.mkdir(exist_ok=True, parents=True)
-        source = BASE_URL + filename
-        log.info(f"Downloading {source}")
-        progress_download(source, destination)
 
+class LocalMirrorSource(DataSource):
+    """Stage files from a local directory mirror of the data repository
 
-def download_cta_data():
-    """Download CTA data."""
-    download_data_files(FILENAMES_CTA)
+    Files are hard-linked if the mirror is on the same filesystem, else
+    reflinked where supported and copied otherwise.
+    """
 
+    def __init__(self, path, link=True):
+        self.path = Path(path)
+        self.link = link
 
-def download_fermi_data():
-    """Download Fermi data."""
-    download_data_files(FILENAMES_FERMI_CATALOG)
-    download_data_files(FILENAMES_FERMI_3FHL_GC)
+    def __str__(self):
+        return str(self.path)
 
+    def fetch(self, filename, destination, progress):
+        source = self.path / filename
+        size = source.stat().st_size
+        progress.add_total(size)
 
-def download_fermi_crab_3fhl():
-    """Download Fermi 3FHL Crab data."""
-    download_data_files(FILENAMES_FERMI_3FHL_CRAB)
+        if self.link:
+            link_or_copy(source, destination)
+        else:
+            tmp = destination.with_name(destination.name + ".part")
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, destination)
 
+        progress.update(size)
 
-def download_magic_data():
-    """Download MAGIC data."""
-    download_data_files(FILENAMES_MAGIC)
 
+class ArchiveSource(DataSource):
+    """Extract files from a pre-packed tar archive in a single streaming pass
 
-def download_hawc_data():
-    """Download HAWC data."""
-    download_data_files(FILENAMES_HAWC)
+    The archive can be a local file or an HTTP(S) URL. Member names are
+    expected relative to the data root, e.g. ``cta-1dc/index/gps/...``.
+    """
 
+    def __init__(self, location):
+        self.location = str(location)
 
-def download_hawc_dl3_data():
-    """Download HAWC data."""
-    download_data_files(FILENAMES_HAWC_DL3)
+    def __str__(self):
+        return self.location
 
+    @contextmanager
+    def _open(self):
+        if urlparse(self.location).scheme not in ["http", "https"]:
+            with tarfile.open(self.location, mode="r|*") as archive:
+                yield archive
+            return
 
-def download_hess_dr1_data():
-    """Download HESS PKS2155 data."""
-    download_data_files(FILENAMES_HESS_DR1)
+        with requests.get(self.location, stream=True, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
 
+            with tarfile.open(fileobj=response.raw, mode="r|*") as archive:
+                yield archive
 
-def download_ebl_models():
-    """Download EBL models"""
-    download_data_files(FILENAMES_EBL)
+    def fetch(self, filename, destination, progress):
+        """Extract a single file, this reads the archive up to its member"""
+        self.fetch_files([filename], progress=progress, n_jobs=1)
 
+    def fetch_files(self, filenames, progress, n_jobs=N_JOBS, on_done=None):
+        """Extract the requested files, see `DataSource.fetch_files`
 
-def download_multi_instrument():
-    download_fermi_crab_3fhl()
-    download_magic_data()
-    download_hawc_data()
+        The archive is read in a single streaming pass, so ``n_jobs`` has no
+        effect.
+        """
+        if n_jobs > 1:
+            log.info(f"Extracting from {self} in a single pass, n_jobs={n_jobs} unused")
 
+        missing = set(filenames)
 
-DATASETS_REGISTRY = {
-    "fermi-gc": download_fermi_data,
-    "cta-1dc": download_cta_data,
-    "pks-flare": download_hess_dr1_data,
-    "multi-instrument": download_multi_instrument,
-    "hawc-dl3": download_hawc_dl3_data,
-    "ebl": download_ebl_models,
-}
+        with self._open() as archive:
+            for member in archive:
+                name = posixpath.normpath(member.name)
+
+                if not member.isfile() or name not in missing:
+                    continue
+
+                destination = PATH_DATA / name
+                destination.parent.mkdir(exist_ok=True, parents=True)
+                tmp = destination.with_name(destination.name + ".part")
+                progress.add_total(member.size)
+
+                with archive.extractfile(member) as src, tmp.open("wb") as dst:
+                    for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                        dst.write(chunk)
+                        progress.update(len(chunk))
+
+                os.replace(tmp, destination)
+
+                if on_done is not None:
+                    on_done(name)
+
+                progress.file_done()
+                missing.remove(name)
+
+                if not missing:
+                    break
+
+        if missing:
+            raise OSError(f"Files not found in archive {self}: {sorted(missing)}")
+
+
+def get_source(location=BASE_URL, retries=RETRIES):
+    """Get data source from a URL, ``file://`` URL, directory or archive path"""
+    if isinstance(location, DataSource):
+        return location
+
+    location = str(location)
+    url = urlparse(location)
+
+    if location.endswith(ARCHIVE_SUFFIXES):
+        if url.scheme == "file":
+            location = url2pathname(url.path)
+        return ArchiveSource(location)
+
+    if url.scheme in ["http", "https"]:
+        return HTTPSource(base_url=location, retries=retries)
+
+    if url.scheme == "file":
+        return LocalMirrorSource(url2pathname(url.path))
+
+    path = Path(location)
+
+    if not path.is_dir():
+        raise ValueError(f"Invalid data source: {location}")
+
+    return LocalMirrorSource(path)
+
+
+def download_data_files(filenames, source=BASE_URL, n_jobs=N_JOBS, manifest=None):
+    """Fetch data files from a source, skipping files which are already valid
+
+    Parameters
+    ----------
+    filenames : list of str
+        Filenames relative to the data root and ``PATH_DATA``.
+    source : str or `DataSource`
+        Base URL, ``file://`` URL, local mirror directory or tar archive.
+    n_jobs : int
+        Maximum number of concurrent downloads.
+    manifest : dict
+        Mapping of filename to expected ``size`` and ``sha256``.
+    """
+    source = get_source(source)
+    manifest = manifest or {}
+    checksums = ChecksumCache()
+
+    unlisted = get_unlisted_files(filenames, manifest)
+
+    if unlisted:
+        log.warning(
+            f"No manifest entry for {len(unlisted)} files, they are only "
+            "checked against the checksum recorded at their download"
+        )
+
+    filenames = [_ for _ in filenames if not verify_file(_, manifest, checksums)]
+
+    if not filenames:
+        log.info("All files present and valid, nothing to download")
+        return
+
+    log.info(f"Fetching {len(filenames)} files from {source} ({n_jobs} jobs)")
+    progress = DownloadProgress(n_files=len(filenames))
+
+    def verify(filename):
+        if filename not in manifest:
+            checksums.record(PATH_DATA / filename)
+        elif not verify_file(filename, manifest, checksums):
+            (PATH_DATA / filename).unlink()
+            raise OSError(f"Checksum mismatch for fetched file {filename}")
+
+    try:
+        source.fetch_files(filenames, progress=progress, n_jobs=n_jobs, on_done=verify)
+    finally:
+        progress.close()
+
+
+def get_unlisted_files(filenames, manifest):
+    """Files without a manifest entry, which can not be verified"""
+    return [_ for _ in filenames if _ not in manifest]
+
+
+def verify_data_files(filenames, manifest):
+    """Verify local files against the manifest, return the invalid ones
+
+    Files without a manifest entry are verified against the checksum
+    recorded at their download. Raises a `ValueError` if any file has
+    neither.
+    """
+    checksums = ChecksumCache()
+    unlisted = [
+        _
+        for _ in get_unlisted_files(filenames, manifest)
+        if not (PATH_DATA / _).exists() or checksums.get_record(PATH_DATA / _) is None
+    ]
+
+    if unlisted:
+        raise ValueError(
+            f"No manifest entry or download record for {len(unlisted)} files, "
+            f"download them again or record them with --update-manifest: {unlisted}"
+        )
+
+    invalid = []
+
+    for filename in filenames:
+        if not verify_file(filename, manifest, checksums, strict=True):
+            log.warning(f"Missing or corrupted file {filename}")
+            invalid.append(filename)
+
+    return invalid
+
+
+def update_manifest_file(dataset, filenames, filename=MANIFEST_FILE):
+    """Record size and checksum of the local files of a dataset in the manifest"""
+    manifest = read_manifest(filename)
+    entries = {}
+
+    for name in filenames:
+        path = PATH_DATA / name
+        entries[name] = {"size": path.stat().st_size, "sha256": sha256sum(path)}
+
+    manifest.setdefault(dataset, {}).update(entries)
+    log.info(f"Writing {filename}")
+    filename.write_text(json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+
+
+def decompress_fits_files(filenames):
+    """Keep uncompressed, memory-mappable copies of gzipped FITS files
+
+    The copies are stored in the cache of ``src/data/fitscache.py``, which
+    also provides the matching read helper.
+    """
+    sys.path.append(str(PATH / "src/data"))
+    import fitscache
+
+    for filename in filenames:
+        if filename.endswith((".fits.gz", ".fit.gz")):
+            fitscache.decompress(PATH_DATA / filename)
+
+
+DATASETS_REGISTRY = read_registry()
+DATASETS_MANIFEST = read_manifest()
 
 
 @click.command()
 @click.argument(
     "dataset", type=click.Choice(list(DATASETS_REGISTRY), case_sensitive=False)
 )
-def cli(dataset):
-    download_method = DATASETS_REGISTRY[dataset]
-    download_method()
+@click.option(
+    "--n-jobs",
+    default=N_JOBS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of concurrent downloads.",
+)
+@click.option(
+    "--source",
+    "--base-url",
+    "source",
+    default=BASE_URL,
+    show_default=True,
+    help="Base URL, file:// URL, local mirror directory or tar archive.",
+)
+@click.option(
+    "--verify-only",
+    is_flag=True,
+    help="Only verify local files against the manifest, do not download.",
+)
+@click.option(
+    "--update-manifest",
+    is_flag=True,
+    help="Record size and checksum of the local files in the manifest.",
+)
+@click.option(
+    "--retries",
+    default=RETRIES,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Number of retries per file on connection errors.",
+)
+@click.option(
+    "--filename",
+    "filenames",
+    multiple=True,
+    help="Only fetch the given file of the dataset, can be repeated.",
+)
+@click.option(
+    "--decompress",
+    is_flag=True,
+    help="Cache uncompressed copies of gzipped FITS files for memory mapping.",
+)
+def cli(
+    dataset,
+    n_jobs,
+    source,
+    verify_only,
+    update_manifest,
+    retries,
+    filenames,
+    decompress,
+):
+    unknown = set(filenames) - set(DATASETS_REGISTRY[dataset])
+
+    if unknown:
+        raise click.ClickException(f"Not part of {dataset}: {sorted(unknown)}")
+
+    filenames = list(filenames) or DATASETS_REGISTRY[dataset]
+    manifest = DATASETS_MANIFEST.get(dataset, {})
+
+    if verify_only:
+        try:
+            invalid = verify_data_files(filenames, manifest)
+        except ValueError as error:
+            raise click.ClickException(f"Can not verify {dataset}: {error}")
+
+        if invalid:
+            raise click.ClickException(f"{len(invalid)} invalid files in {dataset}")
+        log.info(f"All {len(filenames)} files of {dataset} are valid")
+        return
+
+    try:
+        download_data_files(
+            filenames,
+            source=get_source(source, retries=retries),
+            n_jobs=n_jobs,
+            manifest=manifest,
+        )
+    except (requests.RequestException, OSError, ValueError) as error:
+        raise click.ClickException(f"Download of {dataset} failed: {error}")
+
+    if update_manifest:
+        update_manifest_file(dataset, filenames)
+
+    if decompress:
+        decompress_fits_files(filenames)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""Benchmark the event histogram counts image against the dataset based path"""
+import logging
+import time
+
+import numpy as np
+from make import get_observations, make_counts_image, make_counts_image_dataset
+from observations import HDU_CACHE
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+N_REPEAT = 3
+
+
+def benchmark(func, observations):
+    times = []
+
+    for _ in range(N_REPEAT):
+        # read the event lists from disk on every repeat
+        HDU_CACHE.clear()
+        t_start = time.perf_counter()
+        counts = func(observations)
+        times.append(time.perf_counter() - t_start)
+
+    log.info(f"{func.__name__}: {min(times):.3f} s (best of {N_REPEAT})")
+    return counts, min(times)
+
+
+if __name__ == "__main__":
+    observations = get_observations()
+    counts_dataset, time_dataset = benchmark(make_counts_image_dataset, observations)
+    counts, time_histogram = benchmark(make_counts_image, observations)
+
+    n_diff = np.sum(counts.data != counts_dataset.data)
+    log.info(f"Speedup: {time_dataset / time_histogram:.1f}x")
+    log.info(
+        f"Total counts: {counts.data.sum():.0f} vs {counts_dataset.data.sum():.0f}"
+    )
+    log.info(f"Number of differing pixels: {n_diff}")
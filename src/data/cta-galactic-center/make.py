@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+import logging
+import sys
+from pathlib import Path
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import SkyCoord
+from regions import CircleSkyRegion
+
+from gammapy.data import DataStore
+from gammapy.datasets import MapDataset, SpectrumDataset
+from gammapy.makers import (
+    MapDatasetMaker,
+    ReflectedRegionsBackgroundMaker,
+    ReflectedRegionsFinder,
+    SafeMaskMaker,
+    SpectrumDatasetMaker,
+)
+from gammapy.maps import MapAxis, RegionGeom, WcsGeom
+from gammapy.modeling import Fit
+from gammapy.modeling.models import PowerLawSpectralModel, SkyModel
+
+sys.path.append(str(Path(__file__).parent.parent))
+from estimators import ParallelFluxPointsEstimator
+from observations import HDU_CACHE
+from profiling import Profiler
+from reduction import (
+    CachedRegionsFinder,
+    make_counts_map,
+    make_stacked_dataset,
+    reduce_observations,
+)
+from serialization import write_datasets_bulk
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+ENERGY_AXIS = MapAxis.from_edges(
+    np.logspace(-1.0, 1.0, 10), unit="TeV", name="energy", interp="log"
+)
+
+GEOM = WcsGeom.create(
+    skydir=(0, 0),
+    npix=(500, 400),
+    binsz=0.02,
+    frame="galactic",
+    axes=[ENERGY_AXIS.squash()],
+)
+
+
+def get_observations():
+    # Select observations
+    data_store = DataStore.from_dir("../input/cta-1dc/index/gps")
+    obs_id = [110380, 111140, 111159]
+    return HDU_CACHE.get_observations(data_store, obs_id)
+
+
+def make_counts_image(observations):
+    return make_counts_map(GEOM, observations, offset_max=2.5 * u.deg)
+
+
+def make_counts_image_dataset(observations, cache=None):
+    """Counts image from stacked datasets, reference for `make_counts_image`"""
+    stacked = MapDataset.create(geom=GEOM)
+    maker = MapDatasetMaker(selection=["counts"])
+    maker_safe_mask = SafeMaskMaker(methods=["offset-max"], offset_max=2.5 * u.deg)
+
+    stacked = make_stacked_dataset(
+        stacked,
+        observations,
+        makers=[maker, maker_safe_mask],
+        cutout_width="5 deg",
+        cache=cache,
+    )
+    return stacked.counts
+
+
+def make_datasets_spectral(observations, n_jobs=4):
+    target_position = SkyCoord(0, 0, unit="deg", frame="galactic")
+    on_radius = 0.2 * u.deg
+    on_region = CircleSkyRegion(center=target_position, radius=on_radius)
+
+    exclusion_mask = GEOM.to_image().region_mask([on_region], inside=False)
+
+    energy_axis = MapAxis.from_energy_bounds(0.1, 40, 40, unit="TeV", name="energy")
+    energy_axis_true = MapAxis.from_energy_bounds(
+        0.05, 100, 200, unit="TeV", name="energy_true"
+    )
+
+    geom = RegionGeom.create(region=on_region, axes=[energy_axis])
+    dataset_empty = SpectrumDataset.create(geom=geom, energy_axis_true=energy_axis_true)
+
+    dataset_maker = SpectrumDatasetMaker(
+        containment_correction=False, selection=["counts", "exposure", "edisp"]
+    )
+    bkg_maker = ReflectedRegionsBackgroundMaker(
+        region_finder=CachedRegionsFinder(ReflectedRegionsFinder()),
+        exclusion_mask=exclusion_mask,
+    )
+    safe_mask_masker = SafeMaskMaker(methods=["aeff-max"], aeff_percent=10)
+
+    return reduce_observations(
+        dataset_empty,
+        observations,
+        makers=[dataset_maker, bkg_maker, safe_mask_masker],
+        name="obs-{obs_id}",
+        n_jobs=n_jobs,
+    )
+
+
+def make_flux_points(datasets, n_jobs=4):
+    # Flux points are computed on stacked observation
+    stacked_dataset = datasets.stack_reduce(name="stacked")
+    stacked_dataset.models = datasets.models
+
+    energy_edges = MapAxis.from_energy_bounds("1 TeV", "30 TeV", nbin=7).edges
+
+    fpe = ParallelFluxPointsEstimator(
+        energy_edges=energy_edges,
+        source="source-gc",
+        selection_optional="all",
+        n_jobs=n_jobs,
+    )
+    return fpe.run(datasets=[stacked_dataset])
+
+
+def fit_model(datasets):
+    spectral_model = PowerLawSpectralModel(
+        index=2, amplitude=1e-11 * u.Unit("cm-2 s-1 TeV-1"), reference=1 * u.TeV
+    )
+
+    model = SkyModel(spectral_model=spectral_model, name="source-gc")
+
+    datasets.models = model
+
+    fit = Fit()
+    result = fit.run(datasets=datasets)
+    return datasets.models
+
+
+if __name__ == "__main__":
+    profiler = Profiler(name="cta-galactic-center")
+    path = Path(".")
+
+    with profiler.stage("get_observations"):
+        observations = get_observations()
+
+    with profiler.stage("make_counts_image"):
+        filename = path / "stacked-counts.fits"
+        counts = make_counts_image(observations)
+        log.info(f"Writing {filename}")
+        counts.write(filename, overwrite=True)
+
+    with profiler.stage("make_datasets_spectral"):
+        filename = path / "datasets/datasets.bulk"
+        filename.parent.mkdir(exist_ok=True)
+        datasets = make_datasets_spectral(observations)
+        log.info(f"Writing {filename}")
+        write_datasets_bulk(datasets, filename, overwrite=True)
+
+    with profiler.stage("fit_model"):
+        filename = path / "best-fit-model.yaml"
+        models = fit_model(datasets)
+        log.info(f"Writing {filename}")
+        models.write(filename, overwrite=True, write_covariance=False)
+
+    with profiler.stage("make_flux_points"):
+        filename = path / "flux-points.fits"
+        fp = make_flux_points(datasets)
+        log.info(f"Writing {filename}")
+        fp.write(filename, overwrite=True)
+
+    log.info(f"HDU cache: {HDU_CACHE}")
+    profiler.write()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""Compare float32 and float64 map reduction and fitting on the cube analysis
+
+Both datasets are fitted to the same simulated counts, so differences in
+the best-fit parameters are purely due to the reduced precision of the
+float32 dataset. Only the stored maps and the stacking are float32, the
+model prediction and the likelihood in the fit are evaluated in float64
+by gammapy in both cases. Results are written to ``benchmark-dtype.json``.
+
+The float32 mode is only accepted if all best-fit parameters agree within
+``MAX_SHIFT`` of their errors and the total statistics agree within
+``MAX_STAT_DIFF``. Otherwise the benchmark exits with an error.
+"""
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from make import fit_models, get_observations, make_map_dataset, simulate_counts
+
+logging.basicConfig()
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+DTYPES = ["float64", "float32"]
+
+# maximum parameter shift in units of the float64 error
+MAX_SHIFT = 0.1
+
+# maximum absolute difference of the total fit statistic
+MAX_STAT_DIFF = 0.1
+
+
+def get_nbytes(dataset):
+    maps = [dataset.counts, dataset.background, dataset.exposure]
+    maps += [dataset.psf.psf_map, dataset.edisp.edisp_map]
+    return sum(m.data.nbytes for m in maps)
+
+
+def run_benchmark(observations):
+    results, datasets = {}, {}
+
+    for dtype in DTYPES:
+        t_start = time.perf_counter()
+        datasets[dtype] = make_map_dataset(observations, dtype=dtype)
+        results[dtype] = {
+            "time_reduction": time.perf_counter() - t_start,
+            "nbytes": get_nbytes(datasets[dtype]),
+        }
+
+    # fit both datasets to identical counts
+    counts = simulate_counts(datasets["float64"]).counts
+
+    for dtype, stacked in datasets.items():
+        stacked.counts = counts.copy()
+        stacked.counts.data = stacked.counts.data.astype(dtype)
+
+        t_start = time.perf_counter()
+        models = fit_models(stacked)
+        results[dtype]["time_fit"] = time.perf_counter() - t_start
+        results[dtype]["stat_sum"] = float(stacked.stat_sum())
+        results[dtype]["parameters"] = {
+            f"{model.name}.{par.name}": [float(par.value), float(par.error)]
+            for model in models
+            for par in model.parameters.free_parameters
+        }
+
+    return results
+
+
+def check_accuracy(results):
+    """Compare the float32 to the float64 results
+
+    Returns
+    -------
+    failed : list of str
+        Descriptions of the checks exceeding the tolerances.
+    """
+    reference, other = [results[dtype] for dtype in DTYPES]
+    failed = []
+
+    for key in ["time_reduction", "time_fit", "nbytes", "stat_sum"]:
+        log.info(f"{key:>16s}: {reference[key]:.6g} vs {other[key]:.6g}")
+
+    stat_diff = abs(reference["stat_sum"] - other["stat_sum"])
+
+    if not stat_diff <= MAX_STAT_DIFF:
+        failed.append(f"stat_sum differs by {stat_diff:.3g}")
+
+    for name, (value, error) in reference["parameters"].items():
+        value_other, _ = other["parameters"][name]
+        shift = np.abs(value - value_other) / error if error > 0 else np.nan
+        log.info(f"{name:>32s}: {value:.6g} vs {value_other:.6g} ({shift:.2e} sigma)")
+
+        if not shift <= MAX_SHIFT:
+            failed.append(f"{name} shifted by {shift:.3g} sigma")
+
+    return failed
+
+
+if __name__ == "__main__":
+    path = Path(".")
+    observations = get_observations()
+    results = run_benchmark(observations)
+    failed = check_accuracy(results)
+    results["accepted"] = not failed
+
+    filename = path / "benchmark-dtype.json"
+    log.info(f"Writing {filename}")
+    filename.write_text(json.dumps(results, indent=2))
+
+    if failed:
+        log.error("float32 mode is not accurate enough: " + ", ".join(failed))
+        sys.exit(1)
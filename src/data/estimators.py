@@ -0,0 +1,293 @@
+"""Estimator helpers shared by the make.py pipelines"""
+import logging
+from functools import partial
+
+import numpy as np
+import scipy.fft
+from astropy.convolution import Tophat2DKernel
+from astropy.coordinates import Angle
+from gammapy.data import GTI
+from gammapy.datasets import Datasets
+from gammapy.estimators import FluxPointsEstimator, LightCurveEstimator
+from gammapy.maps import Map
+from gammapy.stats import CashCountsStatistic
+from parallel import run_parallel
+
+log = logging.getLogger(__name__)
+
+
+class ExcessMapContext:
+    """Repeated excess map estimation on a fixed dataset geometry
+
+    Computes the same ``sqrt_ts`` map as
+    `~gammapy.estimators.ExcessMapEstimator` with the default energy range,
+    i.e. integrated over the full energy range. As there, the counts are
+    summed over the energy bins within the safe mask, the predicted counts
+    over all energy bins, and both are then masked by the safe mask image.
+    The correlation kernel, its Fourier transform at the padded shape, the
+    safe mask and the correlated counts do not depend on the models and are
+    computed once. Each call of `run` only evaluates and correlates the
+    predicted counts.
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.MapDataset`
+        Dataset defining the geometry, counts and safe mask.
+    correlation_radius : `~astropy.coordinates.Angle`
+        Correlation radius.
+    """
+
+    def __init__(self, dataset, correlation_radius="0.1 deg"):
+        self.correlation_radius = Angle(correlation_radius)
+
+        geom = dataset.counts.geom
+        self.geom = geom.squash(axis_name="energy")
+
+        if dataset.mask_safe is not None:
+            self.mask_safe = dataset.mask_safe.data
+        else:
+            self.mask_safe = np.ones(geom.data_shape, dtype=bool)
+
+        self.mask = self.mask_safe.any(axis=0)
+
+        pixel_size = np.mean(np.abs(geom.wcs.wcs.cdelt))
+        kernel = Tophat2DKernel(self.correlation_radius.deg / pixel_size).array
+        self.kernel = kernel / kernel.max()
+
+        image_shape = self.mask.shape
+        self._slices = tuple(
+            slice((k - 1) // 2, (k - 1) // 2 + n)
+            for n, k in zip(image_shape, self.kernel.shape)
+        )
+        self._fft_shape = tuple(
+            scipy.fft.next_fast_len(n + k - 1, real=True)
+            for n, k in zip(image_shape, self.kernel.shape)
+        )
+        self._kernel_fft = scipy.fft.rfftn(self.kernel, self._fft_shape)
+
+        counts = np.sum(dataset.counts.data * self.mask_safe, axis=0)
+        self.n_on = np.rint(self.correlate(counts))
+
+    def correlate(self, image):
+        """Correlate a masked image with the kernel, same shape as the input"""
+        image = np.where(self.mask, image, 0)
+        image_fft = scipy.fft.rfftn(image, self._fft_shape)
+        result = scipy.fft.irfftn(image_fft * self._kernel_fft, self._fft_shape)
+        return result[self._slices]
+
+    def run(self, dataset):
+        """Compute excess and significance maps for the current dataset models
+
+        Parameters
+        ----------
+        dataset : `~gammapy.datasets.MapDataset`
+            Dataset with the geometry, counts and safe mask of the context.
+
+        Returns
+        -------
+        maps : dict of `~gammapy.maps.WcsNDMap`
+            Correlated "npred", "excess" and "sqrt_ts" maps.
+        """
+        npred = self.correlate(np.sum(dataset.npred().data, axis=0))
+
+        stat = CashCountsStatistic(self.n_on, npred)
+
+        maps = {
+            "npred": npred,
+            "excess": stat.n_sig,
+            "sqrt_ts": stat.sqrt_ts,
+        }
+
+        result = {}
+
+        for name, data in maps.items():
+            data = np.where(self.mask, data, np.nan)
+            result[name] = Map.from_geom(self.geom, data=data[np.newaxis])
+
+        return result
+
+
+def _estimate_flux_point(item, estimator):
+    energy_min, energy_max, datasets = item
+    return estimator.estimate_flux_point(
+        datasets, energy_min=energy_min, energy_max=energy_max
+    )
+
+
+class ParallelFluxPointsEstimator(FluxPointsEstimator):
+    """Flux points estimator fitting the energy bins in parallel
+
+    The datasets are sliced per energy bin in the calling process, so each
+    worker only receives the data of its bin. The results are identical to
+    `~gammapy.estimators.FluxPointsEstimator` and are assembled in the order
+    of the energy bins.
+
+    Parameters
+    ----------
+    n_jobs : int
+        Number of worker processes.
+    executor : `~concurrent.futures.Executor`
+        Executor to use instead of creating a process pool.
+    **kwargs : dict
+        Keyword arguments passed to `~gammapy.estimators.FluxPointsEstimator`.
+    """
+
+    def __init__(self, n_jobs=1, executor=None, **kwargs):
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self._rows = {}
+        super().__init__(**kwargs)
+
+    def __getstate__(self):
+        # executors can not be pickled and are only used in the parent
+        state = self.__dict__.copy()
+        state.update(executor=None, _rows={})
+        return state
+
+    @staticmethod
+    def _key(energy_min, energy_max):
+        return energy_min.to_value("TeV"), energy_max.to_value("TeV")
+
+    def estimate_flux_point(self, datasets, energy_min, energy_max):
+        """Estimate flux point for a single energy group, see `FluxPointsEstimator`"""
+        key = self._key(energy_min, energy_max)
+
+        if key in self._rows:
+            return self._rows.pop(key)
+
+        return super().estimate_flux_point(
+            datasets, energy_min=energy_min, energy_max=energy_max
+        )
+
+    def run(self, datasets):
+        """Run the flux point estimation, see `FluxPointsEstimator.run`"""
+        datasets = Datasets(datasets=datasets)
+        items = []
+
+        energy_edges = self.energy_edges
+
+        for energy_min, energy_max in zip(energy_edges[:-1], energy_edges[1:]):
+            sliced = datasets.slice_by_energy(
+                energy_min=energy_min, energy_max=energy_max
+            )
+
+            if len(sliced) > 0:
+                sliced.models = datasets.models.copy()
+            else:
+                sliced = datasets
+
+            items.append((energy_min, energy_max, sliced))
+
+        rows = run_parallel(
+            partial(_estimate_flux_point, estimator=self),
+            items,
+            n_jobs=self.n_jobs,
+            executor=self.executor,
+        )
+
+        self._rows = {
+            self._key(energy_min, energy_max): row
+            for (energy_min, energy_max, _), row in zip(items, rows)
+        }
+
+        # assemble the precomputed rows with the serial implementation
+        try:
+            return super().run(datasets=datasets)
+        finally:
+            self._rows = {}
+
+
+def _estimate_time_bin_flux(datasets, estimator):
+    return estimator.estimate_time_bin_flux(datasets)
+
+
+class ParallelLightCurveEstimator(LightCurveEstimator):
+    """Light curve estimator fitting the time bins in parallel
+
+    The datasets are selected per time bin in the calling process, so each
+    worker only receives the datasets of its bin. The results are identical
+    to `~gammapy.estimators.LightCurveEstimator` and are assembled in time
+    order. Pass a `~concurrent.futures.ThreadPoolExecutor` as ``executor``
+    to use threads instead of processes.
+
+    Parameters
+    ----------
+    n_jobs : int
+        Number of worker processes.
+    executor : `~concurrent.futures.Executor`
+        Executor to use instead of creating a process pool.
+    **kwargs : dict
+        Keyword arguments passed to `~gammapy.estimators.LightCurveEstimator`.
+    """
+
+    def __init__(self, n_jobs=1, executor=None, **kwargs):
+        self.n_jobs = n_jobs
+        self.executor = executor
+        self._rows = {}
+        super().__init__(**kwargs)
+
+    def __getstate__(self):
+        # executors can not be pickled and are only used in the parent
+        state = self.__dict__.copy()
+        state.update(executor=None, _rows={})
+        return state
+
+    def get_time_bin_datasets(self, datasets):
+        """Datasets of each time bin, empty bins are skipped
+
+        Parameters
+        ----------
+        datasets : `~gammapy.datasets.Datasets`
+            Datasets.
+
+        Returns
+        -------
+        datasets : list of `~gammapy.datasets.Datasets`
+            Datasets per time bin, in time order.
+        """
+        if self.time_intervals is None:
+            gti = datasets.gti
+        else:
+            gti = GTI.from_time_intervals(self.time_intervals)
+
+        gti = gti.union(overlap_ok=False, merge_equal=False)
+        result = []
+
+        for time_min, time_max in gti.time_intervals:
+            selected = datasets.select_time(
+                time_min=time_min, time_max=time_max, atol=self.atol
+            )
+
+            if len(selected) > 0:
+                result.append(selected)
+
+        return result
+
+    def estimate_time_bin_flux(self, datasets, **kwargs):
+        """Estimate flux for a single time bin, see `LightCurveEstimator`"""
+        key = tuple(datasets.names)
+
+        if key in self._rows:
+            return self._rows.pop(key)
+
+        return super().estimate_time_bin_flux(datasets, **kwargs)
+
+    def run(self, datasets):
+        """Run the light curve estimation, see `LightCurveEstimator.run`"""
+        datasets = Datasets(datasets=datasets)
+        items = self.get_time_bin_datasets(datasets)
+
+        rows = run_parallel(
+            partial(_estimate_time_bin_flux, estimator=self),
+            items,
+            n_jobs=self.n_jobs,
+            executor=self.executor,
+        )
+
+        self._rows = {tuple(item.names): row for item, row in zip(items, rows)}
+
+        # assemble the precomputed rows with the serial implementation
+        try:
+            return super().run(datasets=datasets)
+        finally:
+            self._rows = {}
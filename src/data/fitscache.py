@@ -0,0 +1,142 @@
+"""Uncompressed, memory-mappable cache of gzipped FITS input files
+
+Reading a ``.fits.gz`` file decompresses it on every read and rules out
+memory mapping. This module keeps an uncompressed copy of each gzipped
+input, keyed by the SHA256 checksum of the compressed file, which astropy
+can open with ``memmap=True``.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from astropy.io import fits
+
+log = logging.getLogger(__name__)
+
+PATH_CACHE = Path(__file__).parent / ".cache/fits"
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256sum(filename):
+    """Compute the SHA256 hex digest of a file"""
+    checksum = hashlib.sha256()
+
+    with Path(filename).open("rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+def get_index_filename(filename, path_cache=PATH_CACHE):
+    """Index entry of an input file, one small JSON file per input path
+
+    Separate entries allow parallel jobs to update the index without
+    overwriting each other's entries.
+    """
+    checksum = hashlib.sha256(str(filename).encode()).hexdigest()
+    return path_cache / "index" / f"{checksum[:32]}.json"
+
+
+def _read_entry(filename, path_cache):
+    try:
+        return json.loads(get_index_filename(filename, path_cache).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_entry(filename, path_cache, entry):
+    index_filename = get_index_filename(filename, path_cache)
+    index_filename.parent.mkdir(exist_ok=True, parents=True)
+    tmp = index_filename.with_name(f"{index_filename.name}.{os.getpid()}")
+    tmp.write_text(json.dumps(entry, indent=1, sort_keys=True))
+    os.replace(tmp, index_filename)
+
+
+def get_cache_filename(filename, path_cache=PATH_CACHE):
+    """Get filename of the uncompressed copy of a gzipped file in the cache
+
+    The checksum of the compressed file is memoised by path, size and
+    modification time, so it is only computed once per input file.
+    """
+    filename = Path(filename).resolve()
+    stat = filename.stat()
+    entry = _read_entry(filename, path_cache)
+
+    if entry and [entry["size"], entry["mtime_ns"]] == [stat.st_size, stat.st_mtime_ns]:
+        sha256 = entry["sha256"]
+    else:
+        sha256 = sha256sum(filename)
+        entry = {
+            "filename": str(filename),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256,
+        }
+        _write_entry(filename, path_cache, entry)
+
+    name = filename.name.removesuffix(".gz")
+    return path_cache / f"{sha256[:16]}-{name}"
+
+
+def decompress(filename, path_cache=PATH_CACHE):
+    """Decompress a gzipped file into the cache, unless already cached
+
+    Parameters
+    ----------
+    filename : `~pathlib.Path`
+        Gzipped file.
+    path_cache : `~pathlib.Path`
+        Cache directory.
+
+    Returns
+    -------
+    filename : `~pathlib.Path`
+        Uncompressed copy in the cache.
+    """
+    cached = get_cache_filename(filename, path_cache=path_cache)
+
+    if cached.exists():
+        return cached
+
+    log.info(f"Decompressing {filename} to {cached}")
+    tmp = cached.with_name(f"{cached.name}.{os.getpid()}.part")
+
+    with gzip.open(filename, "rb") as src, tmp.open("wb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+    os.replace(tmp, cached)
+    return cached
+
+
+def get_filename(filename, path_cache=PATH_CACHE):
+    """Get the filename to read, the cached uncompressed copy for gzipped files"""
+    if str(filename).endswith(".gz"):
+        return decompress(filename, path_cache=path_cache)
+
+    return Path(filename)
+
+
+def read(cls, filename, path_cache=PATH_CACHE, **kwargs):
+    """Read a gammapy object from a memory mapped, uncompressed FITS file
+
+    Parameters
+    ----------
+    cls : type
+        Class implementing ``from_hdulist``, e.g. `~gammapy.maps.Map` or
+        `~gammapy.irf.PSFMap`.
+    filename : `~pathlib.Path`
+        FITS file, optionally gzipped.
+    path_cache : `~pathlib.Path`
+        Cache directory.
+    **kwargs : dict
+        Keyword arguments passed to ``cls.from_hdulist``.
+    """
+    filename = get_filename(filename, path_cache=path_cache)
+
+    with fits.open(filename, memmap=True) as hdulist:
+        return cls.from_hdulist(hdulist, **kwargs)
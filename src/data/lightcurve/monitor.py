@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+"""Incremental light curve of PKS 2155-304 for near real time monitoring
+
+Each call reduces and fits only the time bins touched by observations that
+were not processed before, and updates the corresponding rows of
+``pks2155_flare_lc_monitor.fits.gz``. The batch product of ``make.py``,
+``pks2155_flare_lc.fits.gz``, is not modified. The state is kept in the
+``monitor`` folder:
+
+- ``state.json``: processed observation ids and time bins
+- ``model.yaml``: spectral model, fitted once to the first update
+- ``bins/<idx>.bulk``: reduced datasets of each time bin
+
+Time bins are aligned to ``T0`` in steps of ``DURATION``. A bin covered by
+several observations, e.g. at a run boundary, is refitted with the stored
+datasets of the previous runs once a new run contributes to it.
+
+The spectral model is fitted to the observations of the first update and
+then kept fixed, so all bins of the monitoring light curve are estimated
+with the same model. It differs from the batch light curve, where the model
+is fitted to all observations. Remove ``model.yaml`` and the light curve
+file to start over with a model fitted to the next update.
+
+Bin files and state are written only after the light curve was updated.
+Stored datasets are named by observation id and bin index and are replaced
+by new datasets of the same name, so an interrupted update can be rerun
+without counting any observation twice. The cost of an update only depends
+on the number of new observations::
+
+    python monitor.py
+    python monitor.py --obs-id 33787 --obs-id 33788
+"""
+import json
+import logging
+import os
+from pathlib import Path
+
+import click
+import numpy as np
+from astropy.table import Table, vstack
+from astropy.time import Time
+from gammapy.data import DataStore
+from gammapy.datasets import Datasets
+from gammapy.modeling.models import Models
+from make import DURATION, T0, data_reduction, fit_stacked, light_curve
+from observations import HDU_CACHE, split_observations_by_time
+from serialization import read_datasets_bulk, write_datasets_bulk
+
+log = logging.getLogger(__name__)
+
+PATH_DATA_STORE = Path("../input/hess-dl3-dr1/")
+TARGET_TAG = "pks2155_flare"
+
+
+def get_bin_index(time, t0=T0, duration=DURATION):
+    """Index of the time bin containing a time"""
+    return int(np.floor((time - t0).to_value("s") / duration.to_value("s")))
+
+
+def get_time_interval(idx, t0=T0, duration=DURATION):
+    """Start and stop time of a time bin"""
+    return Time([t0 + idx * duration, t0 + (idx + 1) * duration])
+
+
+class IncrementalLightCurve:
+    """Light curve updated with new observations as they arrive
+
+    Parameters
+    ----------
+    filename : `~pathlib.Path`
+        Light curve file.
+    path : `~pathlib.Path`
+        State directory.
+    t0 : `~astropy.time.Time`
+        Reference time of the time bins.
+    duration : `~astropy.units.Quantity`
+        Duration of the time bins.
+    n_jobs : int
+        Number of processes to fit the time bins.
+    """
+
+    def __init__(self, filename, path="monitor", t0=T0, duration=DURATION, n_jobs=4):
+        self.filename = Path(filename)
+        self.path = Path(path)
+        self.t0 = t0
+        self.duration = duration
+        self.n_jobs = n_jobs
+
+    @property
+    def filename_state(self):
+        return self.path / "state.json"
+
+    @property
+    def filename_model(self):
+        return self.path / "model.yaml"
+
+    def filename_bin(self, idx):
+        return self.path / f"bins/{idx}.bulk"
+
+    def read_state(self):
+        try:
+            return json.loads(self.filename_state.read_text())
+        except OSError:
+            return {"obs_ids": [], "bins": []}
+
+    def write_state(self, state):
+        self.path.mkdir(exist_ok=True, parents=True)
+        tmp = self.filename_state.with_name(f"state.json.{os.getpid()}")
+        tmp.write_text(json.dumps(state, indent=2))
+        os.replace(tmp, self.filename_state)
+
+    def get_time_intervals(self, observations):
+        """Time bins overlapping the GTIs of observations
+
+        Returns
+        -------
+        intervals : dict of `~astropy.time.Time`
+            Start and stop time by bin index.
+        """
+        intervals = {}
+
+        for observation in observations:
+            gti = observation.gti
+            idx_min = get_bin_index(gti.time_start[0], self.t0, self.duration)
+            idx_max = get_bin_index(gti.time_stop[-1], self.t0, self.duration)
+
+            for idx in range(idx_min, idx_max + 1):
+                intervals[idx] = get_time_interval(idx, self.t0, self.duration)
+
+        return intervals
+
+    def reduce(self, observations, intervals):
+        """Reduce the new observation slices, merged with stored datasets per bin
+
+        Stored datasets with the same name as a new one, i.e. from the same
+        observation, are dropped. Nothing is written.
+
+        Returns
+        -------
+        datasets : dict of `~gammapy.datasets.Datasets`
+            Datasets by bin index.
+        """
+        short_observations = split_observations_by_time(
+            observations, list(intervals.values())
+        )
+        reduced = data_reduction(short_observations)
+
+        datasets = {}
+
+        for observation, dataset in zip(short_observations, reduced):
+            # use the center of the slice, the start is on the bin edge
+            gti = observation.gti
+            time = gti.time_start[0] + 0.5 * (gti.time_stop[-1] - gti.time_start[0])
+            idx = get_bin_index(time, self.t0, self.duration)
+            name = f"{observation.obs_id}-{idx}"
+            datasets.setdefault(idx, Datasets()).append(dataset.copy(name=name))
+
+        for idx, bin_datasets in datasets.items():
+            filename = self.filename_bin(idx)
+
+            if filename.exists():
+                stored = read_datasets_bulk(filename)
+                bin_datasets.extend(
+                    [_ for _ in stored if _.name not in bin_datasets.names]
+                )
+
+        return datasets
+
+    def write_bins(self, datasets):
+        """Write the datasets of each time bin"""
+        for idx, bin_datasets in datasets.items():
+            filename = self.filename_bin(idx)
+            filename.parent.mkdir(exist_ok=True, parents=True)
+            write_datasets_bulk(bin_datasets, filename, overwrite=True)
+
+    def get_model(self, datasets):
+        """Spectral model, fitted to the first update and kept fixed"""
+        if self.filename_model.exists():
+            return Models.read(self.filename_model)["pks2155"]
+
+        sky_model = fit_stacked(datasets)
+        log.info(f"Writing {self.filename_model}")
+        Models([sky_model]).write(
+            self.filename_model, overwrite=True, write_covariance=False
+        )
+        return sky_model
+
+    def write_light_curve(self, lc):
+        """Replace the rows of the updated time bins in the light curve file"""
+        table = lc.to_table(format="lightcurve")
+
+        if self.filename.exists():
+            previous = Table.read(self.filename)
+            updated = np.isin(previous["time_min"], table["time_min"])
+            table = vstack([previous[~updated], table], metadata_conflicts="silent")
+            table.sort("time_min")
+
+        log.info(f"Writing {self.filename}")
+        table.write(self.filename, overwrite=True)
+        return table
+
+    def update(self, observations):
+        """Add observations to the light curve
+
+        Parameters
+        ----------
+        observations : `~gammapy.data.Observations`
+            Observations, already processed ones are skipped.
+
+        Returns
+        -------
+        table : `~astropy.table.Table`
+            Updated light curve table, or None if there were no new data.
+        """
+        state = self.read_state()
+        observations = [
+            obs for obs in observations if int(obs.obs_id) not in state["obs_ids"]
+        ]
+
+        if not observations:
+            log.info("No new observations")
+            return None
+
+        intervals = self.get_time_intervals(observations)
+        datasets = self.reduce(observations, intervals)
+
+        if not datasets:
+            log.info("No new data")
+            return None
+
+        all_datasets = Datasets()
+
+        for bin_datasets in datasets.values():
+            all_datasets.extend(bin_datasets)
+
+        sky_model = self.get_model(all_datasets)
+        time_intervals = [intervals[idx] for idx in sorted(datasets)]
+        lc = light_curve(all_datasets, time_intervals, sky_model, n_jobs=self.n_jobs)
+        table = self.write_light_curve(lc)
+        self.write_bins(datasets)
+
+        state["obs_ids"] += [int(obs.obs_id) for obs in observations]
+        state["bins"] = sorted(set(state["bins"]) | set(datasets))
+        self.write_state(state)
+
+        log.info(
+            f"Updated {len(datasets)} time bins with {len(observations)} "
+            f"observations, {len(state['bins'])} time bins in total"
+        )
+        return table
+
+
+@click.command()
+@click.option(
+    "--obs-id",
+    "obs_ids",
+    multiple=True,
+    type=int,
+    help="Observation id, by default all unprocessed observations of the target.",
+)
+@click.option("--n-jobs", default=4, show_default=True, help="Number of processes.")
+def cli(obs_ids, n_jobs):
+    """Update the PKS 2155-304 monitoring light curve with new observations"""
+    monitor = IncrementalLightCurve("pks2155_flare_lc_monitor.fits.gz", n_jobs=n_jobs)
+    data_store = DataStore.from_dir(PATH_DATA_STORE)
+
+    if not obs_ids:
+        obs_table = data_store.obs_table
+        obs_ids = obs_table[obs_table["TARGET_TAG"] == TARGET_TAG]["OBS_ID"]
+
+    state = monitor.read_state()
+    obs_ids = [int(_) for _ in obs_ids if int(_) not in state["obs_ids"]]
+    observations = HDU_CACHE.get_observations(data_store, obs_ids)
+    monitor.update(observations)
+
+
+if __name__ == "__main__":
+    cli()
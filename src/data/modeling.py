@@ -0,0 +1,320 @@
+"""Modeling helpers shared by the make.py pipelines"""
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import astropy.units as u
+import numpy as np
+from gammapy.datasets import Datasets
+from gammapy.maps import Map
+from gammapy.modeling import Fit
+from gammapy.modeling.models import Models, PointSpatialModel
+
+log = logging.getLogger(__name__)
+
+MODEL_SECTIONS = ["spectral_model", "spatial_model", "temporal_model"]
+
+
+def npred_contributions(dataset, models):
+    """Predicted counts of each model in a spectrum dataset
+
+    Equivalent to setting each model, stripped of its spatial part, on the
+    dataset and calling ``npred_signal()``. Non point-like models are
+    scaled by the fraction of their spatial model contained in the region,
+    point sources are assumed to be handled by the containment correction
+    of the exposure. All models are evaluated in one pass: exposure and
+    energy dispersion are applied to the stacked fluxes of all models at
+    once.
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.SpectrumDataset`
+        Spectrum dataset with exposure and an `~gammapy.irf.EDispKernelMap`.
+    models : list of `~gammapy.modeling.models.SkyModel`
+        Models.
+
+    Returns
+    -------
+    npreds : list of `~gammapy.maps.RegionNDMap`
+        Predicted counts per model, in the order of ``models``.
+    """
+    geom = dataset.counts.geom
+    exposure = dataset.exposure
+
+    energy_edges = exposure.geom.axes["energy_true"].edges
+    energy_min, energy_max = energy_edges[:-1], energy_edges[1:]
+
+    # shape (n_models, energy_true)
+    flux = u.Quantity(
+        [model.spectral_model.integral(energy_min, energy_max) for model in models]
+    )
+
+    # shape (n_models, energy_true, lat, lon)
+    shape = flux.shape + (1,) * (exposure.data.ndim - 1)
+    npred = (flux.reshape(shape) * exposure.quantity).to_value("")
+
+    pdf_matrix = dataset.edisp.get_edisp_kernel().pdf_matrix
+    npred = np.moveaxis(np.moveaxis(npred, 1, -1) @ pdf_matrix, -1, 1)
+
+    npreds = []
+
+    for model, data in zip(models, npred):
+        spatial_model = model.spatial_model
+
+        if spatial_model is not None and not isinstance(
+            spatial_model, PointSpatialModel
+        ):
+            data *= spatial_model.integrate_geom(geom).quantity.to_value("")
+
+        npreds.append(Map.from_geom(geom, data=data))
+
+    return npreds
+
+
+def _get_sections(model):
+    sections = {}
+
+    for name in MODEL_SECTIONS:
+        component = getattr(model, name, None)
+        if component is not None:
+            sections[name] = component.parameters
+
+    if not sections:
+        sections["parameters"] = model.parameters
+
+    return sections
+
+
+def get_parameter_values(models):
+    """Parameter values by model name, model section and parameter name"""
+    values = {}
+
+    for model in models:
+        values[model.name] = {
+            section: {par.name: par.value for par in parameters}
+            for section, parameters in _get_sections(model).items()
+        }
+
+    return values
+
+
+def set_parameter_values(models, values):
+    """Set parameter values, skipping models or parameters not in ``values``
+
+    Returns
+    -------
+    n_values : int
+        Number of parameter values that were set.
+    """
+    n_values = 0
+
+    for model in models:
+        sections = values.get(model.name, {})
+
+        for section, parameters in _get_sections(model).items():
+            for par in parameters:
+                value = sections.get(section, {}).get(par.name)
+
+                if value is not None and not par.frozen:
+                    par.value = value
+                    n_values += 1
+
+    return n_values
+
+
+def warm_start(models, filename):
+    """Initialise the free parameters of models from a previous fit result
+
+    Parameters
+    ----------
+    models : `~gammapy.modeling.models.Models`
+        Models to initialise.
+    filename : `~pathlib.Path`
+        Model file written by a previous fit, e.g. "best-fit-model.yaml".
+    """
+    previous = Models.read(filename)
+    n_values = set_parameter_values(models, get_parameter_values(previous))
+    log.info(f"Warm start of {n_values} parameter values from {filename}")
+
+
+def get_fit_fingerprint(datasets):
+    """Hash of the dataset names and the model parameters of a fit
+
+    The parameter values are not included, because they change during
+    the fit, only the model names and the parameter names, units, bounds
+    and frozen state.
+    """
+    datasets = Datasets(datasets)
+    data = {"datasets": datasets.names, "models": []}
+
+    for model in datasets.models:
+        parameters = [
+            [par.name, str(par.unit), par.min, par.max, par.frozen]
+            for par in model.parameters
+        ]
+        data["models"].append([model.name, model.tag, parameters])
+
+    data = json.dumps(data, default=str).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+class FitCheckpoint:
+    """Periodically write the parameter state of a running fit to disk
+
+    While active, the first dataset counts the likelihood evaluations of
+    the optimiser and every ``every`` evaluations the current parameter
+    values are written to a JSON file, together with the total fit
+    statistic and the optimiser settings. The file is replaced atomically,
+    so an interrupted fit always leaves a readable checkpoint. It is
+    removed once the fit finished without an exception.
+
+    The checkpoint stores a fingerprint of the datasets and models, see
+    `get_fit_fingerprint`, and is only resumed for the same fit.
+
+    Parameters
+    ----------
+    datasets : `~gammapy.datasets.Datasets`
+        Datasets with models.
+    filename : `~pathlib.Path`
+        Checkpoint file.
+    every : int
+        Number of likelihood evaluations between checkpoints.
+    fit : `~gammapy.modeling.Fit`
+        Fit, used to record the optimiser settings.
+    """
+
+    def __init__(self, datasets, filename, every=100, fit=None):
+        self.datasets = Datasets(datasets)
+        self.filename = Path(filename)
+        self.every = every
+        self.fit = fit
+        self.n_evaluations = 0
+        self.fingerprint = get_fit_fingerprint(self.datasets)
+
+    @property
+    def optimizer(self):
+        if self.fit is None:
+            return {}
+
+        return {"backend": self.fit.backend, "optimize_opts": self.fit.optimize_opts}
+
+    def stat_sum(self):
+        """Total fit statistic, bypassing the counting wrapper"""
+        return float(sum(type(_).stat_sum(_) for _ in self.datasets))
+
+    def write(self, status="running"):
+        data = {
+            "status": status,
+            "fingerprint": self.fingerprint,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "n_evaluations": self.n_evaluations,
+            "stat_sum": self.stat_sum(),
+            "optimizer": self.optimizer,
+            "parameters": get_parameter_values(self.datasets.models),
+        }
+
+        self.filename.parent.mkdir(exist_ok=True, parents=True)
+        tmp = self.filename.with_name(f"{self.filename.name}.{os.getpid()}")
+        tmp.write_text(json.dumps(data, indent=2, default=str))
+        os.replace(tmp, self.filename)
+
+    def read(self):
+        try:
+            return json.loads(self.filename.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def resume(self):
+        """Restore the parameter values of an unfinished checkpoint
+
+        Returns
+        -------
+        resumed : bool
+            Whether an unfinished checkpoint of the same fit was found.
+        """
+        data = self.read()
+
+        if data is None or data["status"] == "finished":
+            return False
+
+        if data.get("fingerprint") != self.fingerprint:
+            log.warning(
+                f"Ignoring checkpoint {self.filename}, it was written for "
+                "different datasets or models"
+            )
+            return False
+
+        set_parameter_values(self.datasets.models, data["parameters"])
+        self.n_evaluations = data["n_evaluations"]
+        log.info(
+            f"Resuming fit from {self.filename} after "
+            f"{self.n_evaluations} evaluations"
+        )
+        return True
+
+    def __enter__(self):
+        dataset = self.datasets[0]
+        stat_sum = dataset.stat_sum
+
+        def counting_stat_sum():
+            self.n_evaluations += 1
+
+            if self.n_evaluations % self.every == 0:
+                self.write()
+
+            return stat_sum()
+
+        dataset.stat_sum = counting_stat_sum
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # remove the instance attribute to restore the method
+        del self.datasets[0].stat_sum
+
+        if exc_type is None:
+            self.filename.unlink(missing_ok=True)
+        else:
+            self.write(status="interrupted")
+
+
+def run_fit(datasets, fit=None, checkpoint=None, warm_start_from=None, every=100):
+    """Run a fit with optional warm start and checkpointing
+
+    Parameters
+    ----------
+    datasets : `~gammapy.datasets.Datasets`
+        Datasets with models.
+    fit : `~gammapy.modeling.Fit`
+        Fit, by default ``Fit()``.
+    checkpoint : `~pathlib.Path`
+        If given, write checkpoints to this file and resume from it, if it
+        contains an unfinished fit of the same datasets and models. The
+        file is removed after the fit.
+    warm_start_from : `~pathlib.Path`
+        If given and existing, initialise the parameters from this model
+        file of a previous fit.
+    every : int
+        Number of likelihood evaluations between checkpoints.
+
+    Returns
+    -------
+    result : `~gammapy.modeling.FitResult`
+        Fit result.
+    """
+    datasets = Datasets(datasets)
+    fit = Fit() if fit is None else fit
+
+    if warm_start_from is not None and Path(warm_start_from).exists():
+        warm_start(datasets.models, warm_start_from)
+
+    if checkpoint is None:
+        return fit.run(datasets=datasets)
+
+    checkpoint = FitCheckpoint(datasets, filename=checkpoint, every=every, fit=fit)
+    checkpoint.resume()
+
+    with checkpoint:
+        return fit.run(datasets=datasets)
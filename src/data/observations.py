@@ -0,0 +1,434 @@
+"""In-process cache of the FITS HDUs of observations
+
+`~gammapy.data.Observation` loads events and IRFs lazily from their
+`~gammapy.data.HDULocation` on every access. `HDUCache` replaces these
+locations by `CachedHDULocation` instances, so each HDU is read from disk
+once per process and shared between all observations and accesses.
+
+Event lists can in addition be converted to a columnar sidecar of
+uncompressed ``.npy`` files, which are then memory mapped instead of
+parsing the FITS binary table::
+
+    python observations.py ../input/cta-1dc/data/baseline/gps/*.fits
+
+IRF HDUs are always read from the FITS files.
+
+`split_observations_by_time` slices observations into time intervals with
+one binary search per observation on the time sorted event list, instead
+of filtering the full event list once per interval.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+import click
+import numpy as np
+from astropy.table import Table
+from gammapy.data import EventList, ObservationFilter, Observations
+from gammapy.utils.fits import HDULocation
+from gammapy.utils.time import time_ref_from_dict
+
+log = logging.getLogger(__name__)
+
+PATH_EVENTS = Path(__file__).parent / ".cache/events"
+
+EVENT_COLUMNS = ["TIME", "ENERGY", "RA", "DEC"]
+
+
+def _get_stat(filename):
+    stat = Path(filename).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def get_sidecar_path(filename, hdu="EVENTS", path=PATH_EVENTS):
+    """Folder of the columnar sidecar of an event list HDU"""
+    filename = Path(filename).resolve()
+    checksum = hashlib.sha256(str(filename).encode()).hexdigest()
+    return path / f"{checksum[:16]}-{filename.name}-{hdu}"
+
+
+def write_events_sidecar(
+    filename, hdu="EVENTS", columns=EVENT_COLUMNS, path=PATH_EVENTS
+):
+    """Convert an event list HDU to a columnar sidecar
+
+    Each column is stored as a native byte order ``.npy`` file. The header
+    and the column units are stored in ``header.json``, together with the
+    size and modification time of the FITS file to detect stale sidecars.
+
+    Parameters
+    ----------
+    filename : `~pathlib.Path`
+        Event list FITS file, optionally gzipped.
+    hdu : str
+        Event list HDU name.
+    columns : list of str
+        Columns to store.
+    path : `~pathlib.Path`
+        Sidecar cache directory.
+
+    Returns
+    -------
+    sidecar : `~pathlib.Path`
+        Sidecar folder.
+    """
+    sidecar = get_sidecar_path(filename, hdu=hdu, path=path)
+    table = Table.read(filename, hdu=hdu)
+
+    tmp = sidecar.with_name(f"{sidecar.name}.{os.getpid()}")
+    tmp.mkdir(parents=True, exist_ok=True)
+
+    for name in columns:
+        data = np.asarray(table[name])
+        np.save(tmp / f"{name}.npy", data.astype(data.dtype.newbyteorder("=")))
+
+    header = {
+        "source": _get_stat(filename),
+        "hdu": hdu,
+        "columns": {name: str(table[name].unit or "") for name in columns},
+        "meta": dict(table.meta),
+    }
+    (tmp / "header.json").write_text(json.dumps(header, indent=1, default=str))
+
+    shutil.rmtree(sidecar, ignore_errors=True)
+    os.replace(tmp, sidecar)
+    log.info(f"Wrote {sidecar}")
+    return sidecar
+
+
+def read_events_sidecar(filename, hdu="EVENTS", path=PATH_EVENTS):
+    """Read an event list from its columnar sidecar
+
+    The columns are memory mapped, so no event data is copied.
+
+    Parameters
+    ----------
+    filename : `~pathlib.Path`
+        Event list FITS file.
+    hdu : str
+        Event list HDU name.
+    path : `~pathlib.Path`
+        Sidecar cache directory.
+
+    Returns
+    -------
+    events : `~gammapy.data.EventList`
+        Event list, or None if there is no up to date sidecar.
+    """
+    sidecar = get_sidecar_path(filename, hdu=hdu, path=path)
+
+    try:
+        header = json.loads((sidecar / "header.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+    if header["source"] != _get_stat(filename):
+        log.warning(f"Ignoring outdated event sidecar {sidecar}")
+        return None
+
+    columns = {
+        name: np.load(sidecar / f"{name}.npy", mmap_mode="r")
+        for name in header["columns"]
+    }
+    table = Table(columns, meta=header["meta"], copy=False)
+
+    for name, unit in header["columns"].items():
+        table[name].unit = unit or None
+
+    return EventList(table)
+
+
+def load_hdu(location):
+    """Load an HDU, reading event lists from their sidecar if available"""
+    if location.hdu_class == "events":
+        events = read_events_sidecar(location.path(), hdu=location.hdu_name)
+
+        if events is not None:
+            return events
+
+    return location.load()
+
+
+def get_nbytes(value):
+    """Approximate memory size of a loaded HDU object in bytes"""
+    table = getattr(value, "table", None)
+
+    if table is not None:
+        return sum(np.asarray(column).nbytes for column in table.columns.values())
+
+    data = getattr(value, "data", None)
+
+    if data is not None:
+        return np.asarray(data).nbytes
+
+    return 0
+
+
+class HDUCache:
+    """Least recently used cache of loaded HDUs, keyed by file and HDU name
+
+    Loaded objects are shared between all users of the cache and must not
+    be modified in place.
+
+    Parameters
+    ----------
+    max_size : int
+        Memory budget in bytes. The least recently used HDUs are evicted
+        once the estimated size of the cached objects exceeds it.
+    """
+
+    def __init__(self, max_size=2 * 1024**3):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(n_entries={len(self._entries)}, "
+            f"size={self.size / 1024**2:.1f} MB, hits={self.hits}, "
+            f"misses={self.misses})"
+        )
+
+    @staticmethod
+    def key(location):
+        return str(location.path(abs_path=True)), location.hdu_name
+
+    def load(self, location):
+        """Load an HDU, from the cache if available
+
+        Parameters
+        ----------
+        location : `~gammapy.data.HDULocation`
+            HDU location.
+
+        Returns
+        -------
+        value : object
+            Loaded object, e.g. `~gammapy.data.EventList`.
+        """
+        key = self.key(location)
+
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+        self.misses += 1
+        value = load_hdu(location)
+        nbytes = get_nbytes(value)
+
+        self._entries[key] = value, nbytes
+        self.size += nbytes
+        self.evict()
+        return value
+
+    def evict(self):
+        """Remove least recently used entries until below the memory budget"""
+        while self.size > self.max_size and len(self._entries) > 1:
+            key, (_, nbytes) = self._entries.popitem(last=False)
+            self.size -= nbytes
+            log.debug(f"Evicting {key} from HDU cache")
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def wrap(self, observation):
+        """Replace the HDU locations of an observation by cached locations"""
+        for name, value in list(vars(observation).items()):
+            if isinstance(value, HDULocation):
+                observation.__dict__[name] = CachedHDULocation(value, cache=self)
+
+        return observation
+
+    def get_observations(self, data_store, obs_id=None, **kwargs):
+        """Get observations from a data store, with HDUs loaded through the cache
+
+        Parameters
+        ----------
+        data_store : `~gammapy.data.DataStore`
+            Data store.
+        obs_id : list
+            Observation ids.
+        **kwargs : dict
+            Keyword arguments passed to `~gammapy.data.DataStore.get_observations`.
+
+        Returns
+        -------
+        observations : `~gammapy.data.Observations`
+            Observations.
+        """
+        observations = data_store.get_observations(obs_id, **kwargs)
+
+        for observation in observations:
+            self.wrap(observation)
+
+        return observations
+
+
+HDU_CACHE = HDUCache()
+
+
+class CachedHDULocation:
+    """HDU location loading through an `HDUCache`
+
+    When pickled, e.g. to send observations to worker processes, only the
+    location is kept and the unpickled instance uses the process wide
+    `HDU_CACHE`.
+
+    Parameters
+    ----------
+    location : `~gammapy.data.HDULocation`
+        HDU location.
+    cache : `HDUCache`
+        Cache.
+    """
+
+    def __init__(self, location, cache=None):
+        self.location = location
+        self.cache = HDU_CACHE if cache is None else cache
+
+    def __getattr__(self, name):
+        # only called for attributes not set in __init__
+        if name == "location":
+            raise AttributeError(name)
+
+        return getattr(self.location, name)
+
+    def __reduce__(self):
+        return self.__class__, (self.location,)
+
+    def load(self):
+        return self.cache.load(self.location)
+
+
+def sort_events_by_time(events):
+    """Sort an event list by time
+
+    Returns
+    -------
+    events : `~gammapy.data.EventList`
+        Time sorted event list, the input if it is sorted already.
+    time : `~numpy.ndarray`
+        Event times in seconds since the reference time of the event list.
+    """
+    time = events.table["TIME"].quantity.to_value("s")
+
+    if np.all(time[1:] >= time[:-1]):
+        return events, time
+
+    idx = np.argsort(time, kind="stable")
+    return EventList(events.table[idx]), time[idx]
+
+
+def _split_observation_by_time(observation, time_intervals):
+    """Observation slices by time interval, None for empty intervals"""
+    events, time = sort_events_by_time(observation.events)
+    gti = observation.gti
+    time_ref = time_ref_from_dict(events.table.meta)
+
+    time_min = [(interval[0] - time_ref).to_value("s") for interval in time_intervals]
+    time_max = [(interval[1] - time_ref).to_value("s") for interval in time_intervals]
+
+    # same convention as `EventList.select_time`, tmin <= t < tmax
+    idx_min = np.searchsorted(time, time_min, side="left")
+    idx_max = np.searchsorted(time, time_max, side="left")
+
+    slices = []
+
+    for interval, start, stop in zip(time_intervals, idx_min, idx_max):
+        gti_slice = gti.select_time(interval)
+
+        if len(gti_slice.table) == 0:
+            slices.append(None)
+            continue
+
+        # the filter was applied to events and gti already
+        obs = copy.copy(observation)
+        obs.obs_filter = ObservationFilter()
+        obs._events = EventList(events.table[start:stop])
+        obs._gti = gti_slice
+        slices.append(obs)
+
+    return slices
+
+
+def split_observation_by_time(observation, time_intervals):
+    """Slice an observation into time intervals
+
+    Equivalent to calling ``observation.select_time`` for each interval and
+    dropping empty slices. The events are sorted by time once and each
+    interval is a contiguous slice of the sorted table, found by binary
+    search. If the event list is sorted by time already, as usual for DL3
+    files, the columns of the sliced event lists are views of it, otherwise
+    they are views of a sorted copy made once per observation.
+
+    Parameters
+    ----------
+    observation : `~gammapy.data.Observation`
+        Observation.
+    time_intervals : list of `~astropy.time.Time`
+        Start and stop time of each interval.
+
+    Returns
+    -------
+    observations : list of `~gammapy.data.Observation`
+        Observation slices with in memory events and GTIs.
+    """
+    slices = _split_observation_by_time(observation, time_intervals)
+    return [obs for obs in slices if obs is not None]
+
+
+def split_observations_by_time(observations, time_intervals):
+    """Slice observations into time intervals
+
+    Fast equivalent of `~gammapy.data.Observations.select_time`, see
+    `split_observation_by_time`.
+
+    Parameters
+    ----------
+    observations : `~gammapy.data.Observations`
+        Observations.
+    time_intervals : list of `~astropy.time.Time`
+        Start and stop time of each interval.
+
+    Returns
+    -------
+    observations : `~gammapy.data.Observations`
+        Non empty observation slices, ordered by interval and then by
+        observation, as for ``select_time``.
+    """
+    slices = [_split_observation_by_time(obs, time_intervals) for obs in observations]
+
+    # interval major order
+    slices = [obs for interval in zip(*slices) for obs in interval]
+    return Observations([obs for obs in slices if obs is not None])
+
+
+@click.command()
+@click.argument("filenames", nargs=-1, type=click.Path(exists=True))
+@click.option("--hdu", default="EVENTS", help="Event list HDU name.")
+@click.option(
+    "--column",
+    "columns",
+    multiple=True,
+    default=EVENT_COLUMNS,
+    show_default=True,
+    help="Column to store, can be given multiple times.",
+)
+def cli(filenames, hdu, columns):
+    """Convert event list FITS files to memory mappable columnar sidecars"""
+    for filename in filenames:
+        write_events_sidecar(filename, hdu=hdu, columns=list(columns))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    cli()
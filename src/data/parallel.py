@@ -0,0 +1,43 @@
+"""Helpers to run independent tasks in a pool of worker processes"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+def run_parallel(func, items, n_jobs=1, executor=None):
+    """Apply a function to each item, results are returned in input order
+
+    Parameters
+    ----------
+    func : callable
+        Function of a single argument. Must be picklable, i.e. defined at
+        module level or a `functools.partial` thereof.
+    items : iterable
+        Arguments.
+    n_jobs : int
+        Number of worker processes. With ``n_jobs=1`` the items are
+        processed serially in the current process.
+    executor : `~concurrent.futures.Executor`
+        Executor to use instead of creating a process pool, e.g. a
+        `~concurrent.futures.ThreadPoolExecutor`.
+
+    Returns
+    -------
+    results : list
+        Results in the order of ``items``.
+    """
+    items = list(items)
+
+    if executor is not None:
+        return list(executor.map(func, items))
+
+    n_jobs = min(n_jobs, len(items))
+
+    if n_jobs <= 1:
+        return [func(item) for item in items]
+
+    log.info(f"Running {len(items)} tasks on {n_jobs} processes")
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(func, items))
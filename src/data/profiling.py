@@ -0,0 +1,196 @@
+"""Per-stage timing and peak memory instrumentation for the data pipelines
+
+Each ``make.py`` script wraps its stages in `Profiler.stage`, which records
+wall time, CPU time and peak resident memory. Results are written together
+with run metadata to ``run-times/<name>.json`` and appended to
+``run-times/stages.csv`` in this folder.
+"""
+import csv
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from importlib import metadata
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+PATH_RUN_TIMES = Path(__file__).parent / "run-times"
+
+PACKAGES = ["gammapy", "numpy", "scipy", "astropy", "iminuit", "regions", "naima"]
+
+CSV_COLUMNS = [
+    "timestamp",
+    "name",
+    "stage",
+    "wall_time",
+    "cpu_time",
+    "cpu_time_children",
+    "peak_rss",
+    "host",
+]
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of the process, return whether it is supported
+
+    Only supported on Linux, where writing "5" to ``/proc/self/clear_refs``
+    resets the ``VmHWM`` high-water mark.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+    except OSError:
+        return False
+
+    return True
+
+
+def get_peak_rss():
+    """Peak resident set size of the process in MB"""
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    # fall back to the peak over the lifetime of the process
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    scale = 1024**2 if sys.platform == "darwin" else 1024
+    return maxrss / scale
+
+
+def get_run_metadata():
+    """Host, core count and library versions of the current run"""
+    versions = {}
+
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+
+    if hasattr(os, "sched_getaffinity"):
+        n_cores_available = len(os.sched_getaffinity(0))
+    else:
+        n_cores_available = os.cpu_count()
+
+    return {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "n_cores": os.cpu_count(),
+        "n_cores_available": n_cores_available,
+        "python": platform.python_version(),
+        "versions": versions,
+        "argv": sys.argv,
+    }
+
+
+class Profiler:
+    """Record wall time, CPU time and peak RSS for each pipeline stage
+
+    Peak RSS is reset at the start of each stage where the platform
+    supports it, otherwise it is the peak since the start of the process.
+
+    Parameters
+    ----------
+    name : str
+        Name of the pipeline, e.g. "cube-analysis".
+    path : `~pathlib.Path`
+        Output folder.
+
+    Examples
+    --------
+    >>> profiler = Profiler(name="cube-analysis")
+    >>> with profiler.stage("get_observations"):
+    ...     observations = get_observations()
+    >>> profiler.write()
+    """
+
+    def __init__(self, name, path=PATH_RUN_TIMES):
+        self.name = name
+        self.path = Path(path)
+        self.stages = []
+        self.timestamp = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self._t_start = time.perf_counter()
+        self._peak_rss_reset = reset_peak_rss()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager measuring a single stage"""
+        reset_peak_rss()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        try:
+            yield
+        finally:
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            cpu_time_children = (children.ru_utime - children_start.ru_utime) + (
+                children.ru_stime - children_start.ru_stime
+            )
+            record = {
+                "stage": name,
+                "wall_time": time.perf_counter() - wall_start,
+                "cpu_time": time.process_time() - cpu_start,
+                "cpu_time_children": cpu_time_children,
+                "peak_rss": get_peak_rss(),
+            }
+            self.stages.append(record)
+            log.info(
+                f"{self.name}/{name}: {record['wall_time']:.2f} s wall, "
+                f"{record['cpu_time']:.2f} s cpu, {record['peak_rss']:.0f} MB peak"
+            )
+
+    @property
+    def total_wall_time(self):
+        return time.perf_counter() - self._t_start
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "timestamp": self.timestamp,
+            "total_wall_time": self.total_wall_time,
+            "peak_rss_per_stage": self._peak_rss_reset,
+            "metadata": get_run_metadata(),
+            "stages": self.stages,
+        }
+
+    def write(self):
+        """Write JSON summary of this run and append stages to the CSV log"""
+        self.path.mkdir(exist_ok=True, parents=True)
+        data = self.to_dict()
+
+        filename = self.path / f"{self.name}.json"
+        log.info(f"Writing {filename}")
+        filename.write_text(json.dumps(data, indent=2))
+
+        filename = self.path / "stages.csv"
+        write_header = not filename.exists()
+
+        with filename.open("a", newline="") as fh:
+            writer = csv.DictWriter(fh, fieldnames=CSV_COLUMNS)
+
+            if write_header:
+                writer.writeheader()
+
+            rows = self.stages + [
+                {"stage": "total", "wall_time": data["total_wall_time"]}
+            ]
+
+            for row in rows:
+                row = {
+                    "timestamp": self.timestamp,
+                    "name": self.name,
+                    "host": data["metadata"]["host"],
+                    **row,
+                }
+                writer.writerow(row)
@@ -0,0 +1,912 @@
+"""Data reduction helpers shared by the make.py pipelines"""
+import copy
+import hashlib
+import logging
+import os
+from functools import partial
+from pathlib import Path
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import Angle
+from astropy.nddata import NoOverlapError
+
+import gammapy
+from gammapy.data import GTI
+from gammapy.datasets import Datasets, MapDataset
+from gammapy.datasets.map import create_map_dataset_geoms
+from gammapy.irf import EDispKernelMap, EDispMap, PSFMap
+from gammapy.makers import MapDatasetMaker, SafeMaskMaker, SpectrumDatasetMaker
+from gammapy.maps import Map, WcsGeom
+from parallel import run_parallel
+
+log = logging.getLogger(__name__)
+
+PATH_CACHE = Path(__file__).parent / ".cache/datasets"
+
+# bump to invalidate existing cache entries after changes to the key
+CACHE_VERSION = 2
+
+# maker attributes which determine the reduced dataset, by maker class
+MAKER_CONFIG = {
+    "MapDatasetMaker": [
+        "selection",
+        "background_oversampling",
+        "background_interp_missing_data",
+        "background_pad_offset",
+    ],
+    "SpectrumDatasetMaker": [
+        "selection",
+        "containment_correction",
+        "use_region_center",
+        "background_oversampling",
+        "background_interp_missing_data",
+        "background_pad_offset",
+    ],
+    "SafeMaskMaker": [
+        "methods",
+        "aeff_percent",
+        "bias_percent",
+        "position",
+        "fixed_offset",
+        "offset_max",
+    ],
+}
+
+
+def get_maker_config(maker):
+    """Configuration of a maker, as listed in `MAKER_CONFIG`
+
+    Raises a `ValueError` for makers without an entry, as their reduced
+    datasets can not be cached safely.
+    """
+    for cls in type(maker).__mro__:
+        names = MAKER_CONFIG.get(cls.__name__)
+
+        if names is not None:
+            return {name: getattr(maker, name) for name in names}
+
+    raise ValueError(f"No cache configuration for {type(maker).__name__}")
+
+
+def get_observation_files(observation):
+    """Paths, sizes and modification times of the files of an observation"""
+    files = {}
+
+    for value in vars(observation).values():
+        if not hasattr(value, "hdu_name"):
+            continue
+
+        path = value.path(abs_path=True)
+        stat = path.stat()
+        files[str(path)] = [stat.st_size, stat.st_mtime_ns]
+
+    return files
+
+
+def cast_dataset(dataset, dtype):
+    """Cast the float maps of a map dataset in place
+
+    Counts, background, exposure and the PSF and energy dispersion maps,
+    including their exposure maps, are cast to ``dtype``. Masks are left
+    unchanged. The likelihood is still accumulated in float64, because
+    `MapDataset.stat_sum` casts the counts and the model prediction is
+    evaluated in float64.
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.MapDataset`
+        Dataset.
+    dtype : `~numpy.dtype`
+        Data type, e.g. "float32".
+
+    Returns
+    -------
+    dataset : `~gammapy.datasets.MapDataset`
+        The same dataset.
+    """
+    maps = [dataset.counts, dataset.background, dataset.exposure]
+
+    if dataset.psf is not None:
+        maps += [dataset.psf.psf_map, dataset.psf.exposure_map]
+
+    if dataset.edisp is not None:
+        maps += [dataset.edisp.edisp_map, dataset.edisp.exposure_map]
+
+    for m in maps:
+        if m is not None:
+            m.data = m.data.astype(dtype, copy=False)
+
+    return dataset
+
+
+class ReducedDatasetCache:
+    """Content-addressed on-disk cache of reduced per-observation datasets
+
+    Entries are keyed by a hash of the observation id and pointing, the
+    size and modification time of its event and IRF files, the reference
+    geometry including all energy axes, the cutout width and the
+    configuration of all makers listed in `MAKER_CONFIG`. The
+    least recently used entries are evicted once the cache exceeds
+    ``max_size``.
+
+    Parameters
+    ----------
+    path : `~pathlib.Path`
+        Cache directory.
+    max_size : int
+        Maximum total size of the cache in bytes.
+    """
+
+    def __init__(self, path=PATH_CACHE, max_size=20 * 1024**3):
+        self.path = Path(path)
+        self.max_size = max_size
+
+    @staticmethod
+    def _update_hash(checksum, value):
+        if isinstance(value, Map):
+            ReducedDatasetCache._update_hash(checksum, value.geom)
+            checksum.update(np.ascontiguousarray(value.data).tobytes())
+        elif hasattr(value, "wcs") and hasattr(value, "axes"):
+            checksum.update(value.wcs.to_header_string().encode())
+            checksum.update(str(getattr(value, "region", None)).encode())
+            checksum.update(np.asarray(value.data_shape).tobytes())
+            for axis in value.axes:
+                checksum.update(axis.name.encode())
+                checksum.update(np.asarray(axis.edges.value).tobytes())
+                checksum.update(str(axis.unit).encode())
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                ReducedDatasetCache._update_hash(checksum, item)
+        elif isinstance(value, (set, frozenset)):
+            # the iteration order of sets of strings changes between runs
+            for item in sorted(value, key=repr):
+                ReducedDatasetCache._update_hash(checksum, item)
+        elif isinstance(value, dict):
+            for name in sorted(value, key=str):
+                checksum.update(str(name).encode())
+                ReducedDatasetCache._update_hash(checksum, value[name])
+        elif isinstance(value, u.Quantity):
+            checksum.update(np.asarray(value.value).tobytes())
+            checksum.update(str(value.unit).encode())
+        else:
+            checksum.update(repr(value).encode())
+
+    def key(self, dataset, observation, makers, cutout_width=None, dtype=None):
+        """Cache key of an observation reduced onto a reference dataset"""
+        checksum = hashlib.sha256()
+        pointing = observation.pointing_radec.icrs
+
+        values = [
+            CACHE_VERSION,
+            gammapy.__version__,
+            observation.obs_id,
+            u.Quantity([pointing.ra, pointing.dec]),
+            Angle(cutout_width) if cutout_width is not None else None,
+            np.dtype(dtype).name if dtype is not None else None,
+            get_observation_files(observation),
+        ]
+
+        for value in values:
+            self._update_hash(checksum, value)
+
+        for name, geom in dataset.geoms.items():
+            self._update_hash(checksum, [name, geom])
+
+        for maker in makers:
+            self._update_hash(checksum, [type(maker).__name__, get_maker_config(maker)])
+
+        return checksum.hexdigest()
+
+    def filename(self, key):
+        return self.path / f"{key}.fits"
+
+    def get(self, key):
+        """Read a cached dataset, return None if not cached"""
+        filename = self.filename(key)
+
+        try:
+            dataset = MapDataset.read(filename)
+        except FileNotFoundError:
+            return None
+
+        # update the modification time to track the least recently used
+        os.utime(filename)
+        return dataset
+
+    def put(self, key, dataset):
+        """Write a dataset to the cache and evict old entries"""
+        self.path.mkdir(exist_ok=True, parents=True)
+        filename = self.filename(key)
+        tmp = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+        dataset.write(tmp, overwrite=True)
+        os.replace(tmp, filename)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until below the maximum size"""
+        entries = []
+
+        for filename in self.path.glob("*.fits"):
+            try:
+                stat = filename.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        size = sum(_[1] for _ in entries)
+
+        for _, entry_size, filename in sorted(entries):
+            if size <= self.max_size:
+                break
+
+            log.debug(f"Evicting {filename} from cache")
+            filename.unlink(missing_ok=True)
+            size -= entry_size
+
+
+def reduce_observation(
+    dataset, observation, makers, cutout_width=None, cache=None, dtype=None
+):
+    """Reduce a single observation by running a sequence of makers
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.MapDataset`
+        Reference dataset defining the geometry.
+    observation : `~gammapy.data.Observation`
+        Observation to reduce.
+    makers : list
+        Makers with a ``run(dataset, observation)`` method, applied in order.
+    cutout_width : `~astropy.coordinates.Angle`
+        If given, reduce a cutout of this width around the pointing position.
+    cache : `ReducedDatasetCache`
+        If given, read the reduced dataset from the cache, or reduce it and
+        add it to the cache.
+    dtype : `~numpy.dtype`
+        If given, cast the reduced dataset to this data type.
+
+    Returns
+    -------
+    dataset : `~gammapy.datasets.MapDataset`
+        Reduced dataset.
+    """
+    if cache is not None:
+        key = cache.key(
+            dataset, observation, makers, cutout_width=cutout_width, dtype=dtype
+        )
+        cached = cache.get(key)
+
+        if cached is not None:
+            log.info(f"Using cached reduced dataset for obs {observation.obs_id}")
+            return cached
+
+    if cutout_width is not None:
+        dataset = dataset.cutout(observation.pointing_radec, width=cutout_width)
+
+    for maker in makers:
+        dataset = maker.run(dataset, observation)
+
+    if dtype is not None:
+        cast_dataset(dataset, dtype)
+
+    if cache is not None:
+        cache.put(key, dataset)
+
+    return dataset
+
+
+class CachedRegionsFinder:
+    """Region finder caching the OFF regions of previous runs
+
+    Wraps a region finder, e.g. `~gammapy.makers.ReflectedRegionsFinder` or
+    `~gammapy.makers.WobbleRegionsFinder`, and caches its results keyed by
+    the pointing position, the ON region, the exclusion mask and the finder
+    configuration. Observations with identical pointings, e.g. time slices
+    of the same run, reuse the OFF regions.
+
+    The cache lives in the process. Worker processes receive a copy of the
+    finder with the regions found so far, see `resolve_off_regions`.
+
+    Parameters
+    ----------
+    region_finder : `~gammapy.makers.RegionsFinder`
+        Region finder.
+    """
+
+    def __init__(self, region_finder):
+        self.region_finder = region_finder
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, region, center, exclusion_mask=None):
+        checksum = hashlib.sha256()
+        center = center.icrs
+        values = [
+            self.region_finder.__class__.__name__,
+            vars(self.region_finder),
+            u.Quantity([center.ra, center.dec]),
+            str(region),
+            exclusion_mask,
+        ]
+        ReducedDatasetCache._update_hash(checksum, values)
+        return checksum.hexdigest()
+
+    def run(self, region, center, exclusion_mask=None):
+        """Find OFF regions, see `~gammapy.makers.RegionsFinder.run`"""
+        key = self.key(region, center, exclusion_mask=exclusion_mask)
+
+        if key in self._cache:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._cache[key] = self.region_finder.run(
+                region=region, center=center, exclusion_mask=exclusion_mask
+            )
+
+        regions, wcs = self._cache[key]
+        return list(regions), wcs
+
+
+class CachedSpectrumDatasetMaker(SpectrumDatasetMaker):
+    """Spectrum dataset maker reusing the IRF products of previous runs
+
+    Time slices of the same observation share pointing and IRFs and differ
+    only in their livetime. The exposure, including the containment
+    correction, and the energy dispersion kernel are computed once per
+    observation id, pointing and geometry and rescaled by the livetime of
+    each slice. Slices without livetime are computed, but not cached. Counts
+    are always binned from the events of the slice.
+
+    Parameters
+    ----------
+    **kwargs : dict
+        Keyword arguments passed to `~gammapy.makers.SpectrumDatasetMaker`.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(name, geom, observation):
+        checksum = hashlib.sha256()
+        pointing = observation.pointing_radec.icrs
+        values = [
+            name,
+            observation.obs_id,
+            u.Quantity([pointing.ra, pointing.dec]),
+            geom,
+        ]
+        ReducedDatasetCache._update_hash(checksum, values)
+        return checksum.hexdigest()
+
+    def _get_cached(self, name, geom, observation, make):
+        key = self.key(name, geom, observation)
+        livetime = observation.observation_live_time_duration
+
+        if livetime <= 0:
+            # can not be rescaled to other slices, e.g. a slice outside the GTIs
+            self.misses += 1
+            return make(geom, observation), 1.0
+
+        if key in self._cache:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._cache[key] = make(geom, observation), livetime
+
+        value, livetime_ref = self._cache[key]
+        return copy.deepcopy(value), (livetime / livetime_ref).to_value("")
+
+    def make_exposure(self, geom, observation):
+        """Make exposure, see `~gammapy.makers.SpectrumDatasetMaker.make_exposure`"""
+        exposure, ratio = self._get_cached(
+            "exposure", geom, observation, super().make_exposure
+        )
+        exposure.data *= ratio
+
+        if "livetime" in exposure.meta:
+            exposure.meta["livetime"] = observation.observation_live_time_duration
+
+        return exposure
+
+    def make_edisp_kernel(self, geom, observation):
+        """Make edisp kernel, see `~gammapy.makers.MapDatasetMaker.make_edisp_kernel`"""
+        edisp, ratio = self._get_cached(
+            "edisp", geom, observation, super().make_edisp_kernel
+        )
+
+        # the exposure is only used as weight for stacking
+        if edisp.exposure_map is not None:
+            edisp.exposure_map.data *= ratio
+
+        return edisp
+
+
+def resolve_off_regions(dataset, observations, makers):
+    """Find the OFF regions of observations in the current process
+
+    Runs the `CachedRegionsFinder` of each background maker for the pointing
+    of every observation, as the maker does, so that copies of the makers
+    sent to worker processes already contain all OFF regions.
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.SpectrumDataset`
+        Empty dataset defining the ON region.
+    observations : `~gammapy.data.Observations`
+        Observations.
+    makers : list
+        Makers, the ones without a `CachedRegionsFinder` are skipped.
+    """
+    region = dataset.counts.geom.region
+
+    for maker in makers:
+        finder = getattr(maker, "region_finder", None)
+
+        if not isinstance(finder, CachedRegionsFinder):
+            continue
+
+        hits, misses = finder.hits, finder.misses
+
+        for observation in observations:
+            finder.run(
+                region=region,
+                center=observation.pointing_radec,
+                exclusion_mask=maker.exclusion_mask,
+            )
+
+        log.info(
+            f"OFF regions of {len(observations)} observations: "
+            f"{finder.misses - misses} computed, {finder.hits - hits} reused"
+        )
+
+
+def _reduce_named(observations, dataset, makers, name):
+    datasets = []
+
+    for observation in observations:
+        named = dataset.copy(name=name.format(obs_id=observation.obs_id))
+        datasets.append(reduce_observation(named, observation, makers=makers))
+
+    return datasets
+
+
+def reduce_observations(dataset, observations, makers, name="{obs_id}", n_jobs=1):
+    """Reduce observations to one dataset each, optionally in parallel
+
+    The OFF regions of all observations are found upfront in the current
+    process, see `resolve_off_regions`. Observations with the same id, e.g.
+    time slices of a run, are reduced by the same task, so each worker reads
+    the HDUs of a run once.
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.Dataset`
+        Empty dataset defining the geometry.
+    observations : `~gammapy.data.Observations`
+        Observations to reduce.
+    makers : list
+        Makers with a ``run(dataset, observation)`` method, applied in order.
+    name : str
+        Template of the dataset names, formatted with the ``obs_id``.
+    n_jobs : int
+        Number of worker processes.
+
+    Returns
+    -------
+    datasets : `~gammapy.datasets.Datasets`
+        Reduced datasets, in the order of the observations.
+    """
+    observations = list(observations)
+    resolve_off_regions(dataset, observations, makers)
+
+    groups = {}
+
+    for idx, observation in enumerate(observations):
+        groups.setdefault(observation.obs_id, []).append(idx)
+
+    tasks = [[observations[idx] for idx in group] for group in groups.values()]
+    func = partial(_reduce_named, dataset=dataset, makers=makers, name=name)
+    results = run_parallel(func, tasks, n_jobs=n_jobs)
+
+    datasets = [None] * len(observations)
+
+    for group, reduced in zip(groups.values(), results):
+        for idx, result in zip(group, reduced):
+            datasets[idx] = result
+
+    return Datasets(datasets)
+
+
+def _reduce_and_stack(observations, stacked, makers, cutout_width, cache, dtype):
+    """Reduce observations and stack them onto a copy of the stacked dataset"""
+    stacked = stacked.copy(name=stacked.name)
+
+    for observation in observations:
+        dataset = reduce_observation(
+            stacked,
+            observation,
+            makers=makers,
+            cutout_width=cutout_width,
+            cache=cache,
+            dtype=dtype,
+        )
+        stacked.stack(dataset)
+
+    return stacked
+
+
+def make_stacked_dataset(
+    stacked, observations, makers, cutout_width, n_jobs=1, cache=None, dtype=None
+):
+    """Reduce observations in parallel and stack them
+
+    The observations are split into ``n_jobs`` groups. Each worker process
+    reduces the cutouts of its group and stacks them onto its own copy of
+    the empty ``stacked`` dataset, so each process returns a single partial
+    stack. The ``n_jobs`` partial stacks are merged serially, which is
+    cheaper than sending them between processes again.
+
+    Parameters
+    ----------
+    stacked : `~gammapy.datasets.MapDataset`
+        Empty dataset defining the stacked geometry.
+    observations : `~gammapy.data.Observations`
+        Observations to reduce.
+    makers : list
+        Makers with a ``run(dataset, observation)`` method, applied in order.
+    cutout_width : `~astropy.coordinates.Angle`
+        Width of the cutout around the pointing position of each observation.
+    n_jobs : int
+        Number of worker processes.
+    cache : `ReducedDatasetCache`
+        Optional cache of reduced per-observation datasets.
+    dtype : `~numpy.dtype`
+        If given, cast the stacked and the reduced datasets to this data
+        type, e.g. "float32" to halve the memory traffic of stacking.
+
+    Returns
+    -------
+    stacked : `~gammapy.datasets.MapDataset`
+        Stacked dataset.
+    """
+    observations = list(observations)
+    n_jobs = max(min(n_jobs, len(observations)), 1)
+    groups = [observations[idx::n_jobs] for idx in range(n_jobs)]
+
+    if dtype is not None:
+        stacked = cast_dataset(stacked.copy(name=stacked.name), dtype)
+
+    func = partial(
+        _reduce_and_stack,
+        stacked=stacked,
+        makers=makers,
+        cutout_width=cutout_width,
+        cache=cache,
+        dtype=dtype,
+    )
+    partial_stacks = run_parallel(func, groups, n_jobs=n_jobs)
+    stacked = partial_stacks[0]
+
+    for dataset in partial_stacks[1:]:
+        stacked.stack(dataset)
+
+    return stacked
+
+
+def _memmap_map(geom, filename, dtype, unit=""):
+    data = np.lib.format.open_memmap(
+        filename, mode="w+", dtype=dtype, shape=geom.data_shape
+    )
+    return Map.from_geom(geom, data=data, unit=unit)
+
+
+def create_memmap_dataset(
+    geom, energy_axis_true, path, binsz_irf=None, name=None, dtype=None
+):
+    """Create an empty map dataset backed by memory mapped arrays on disk
+
+    Counts, background, exposure and safe mask are stored as ``.npy`` files
+    in ``path``. The PSF and energy dispersion maps are binned coarsely and
+    kept in memory.
+
+    Parameters
+    ----------
+    geom : `~gammapy.maps.WcsGeom`
+        Reconstructed energy geometry.
+    energy_axis_true : `~gammapy.maps.MapAxis`
+        True energy axis.
+    path : `~pathlib.Path`
+        Folder for the memory mapped arrays.
+    binsz_irf : float
+        Pixel size of the IRF maps in deg.
+    name : str
+        Name of the dataset.
+    dtype : `~numpy.dtype`
+        Data type of the float maps, by default float64 as for
+        `~gammapy.datasets.MapDataset.create`.
+
+    Returns
+    -------
+    dataset : `~gammapy.datasets.MapDataset`
+        Empty dataset.
+    """
+    dtype = np.dtype("float64" if dtype is None else dtype)
+    path = Path(path)
+    path.mkdir(exist_ok=True, parents=True)
+
+    geoms = create_map_dataset_geoms(
+        geom, energy_axis_true=energy_axis_true, binsz_irf=binsz_irf
+    )
+
+    geom_edisp = geoms["geom_edisp"]
+
+    if "energy" in geom_edisp.axes.names:
+        edisp = EDispKernelMap.from_geom(geom_edisp)
+    else:
+        edisp = EDispMap.from_geom(geom_edisp)
+
+    dataset = MapDataset(
+        counts=_memmap_map(geom, path / "counts.npy", dtype=dtype),
+        background=_memmap_map(geom, path / "background.npy", dtype=dtype),
+        exposure=_memmap_map(
+            geoms["geom_exposure"], path / "exposure.npy", dtype=dtype, unit="m2 s"
+        ),
+        psf=PSFMap.from_geom(geoms["geom_psf"]),
+        edisp=edisp,
+        mask_safe=_memmap_map(geom, path / "mask_safe.npy", dtype=bool),
+        gti=GTI.create([] * u.s, [] * u.s),
+        name=name,
+    )
+
+    # the memory mapped arrays have the right type already and are kept
+    return cast_dataset(dataset, dtype)
+
+
+def iter_tiles(geom, tile_size):
+    """Iterate over spatial tiles of a geometry
+
+    Parameters
+    ----------
+    geom : `~gammapy.maps.WcsGeom`
+        Geometry.
+    tile_size : int
+        Maximum width and height of a tile in pixels.
+
+    Yields
+    ------
+    slices : tuple of slice
+        Slices of the tile along the lat and lon axes of the data.
+    geom : `~gammapy.maps.WcsGeom`
+        Geometry of the tile, including the non-spatial axes.
+    """
+    ny, nx = geom.data_shape[-2:]
+
+    for y in range(0, ny, tile_size):
+        for x in range(0, nx, tile_size):
+            slices = slice(y, min(y + tile_size, ny)), slice(x, min(x + tile_size, nx))
+            npix = (slices[1].stop - x, slices[0].stop - y)
+            wcs = geom.wcs.slice(slices)
+            yield slices, WcsGeom(wcs=wcs, npix=npix, axes=geom.axes)
+
+
+def _create_tile_dataset(stacked, geom):
+    geom_exposure = stacked.exposure.geom
+    geom_exposure = geom.to_image().to_cube(geom_exposure.axes)
+
+    return MapDataset(
+        counts=Map.from_geom(geom),
+        background=Map.from_geom(geom),
+        exposure=Map.from_geom(geom_exposure, unit=stacked.exposure.unit),
+        mask_safe=Map.from_geom(geom, dtype=bool),
+    )
+
+
+def _split_irf_makers(makers):
+    """Split makers into makers for the tiles and the IRF selection"""
+    tile_makers, irf_selection = [], []
+
+    for maker in makers:
+        if isinstance(maker, MapDatasetMaker):
+            irf_selection = [_ for _ in maker.selection if _ in ["psf", "edisp"]]
+            maker = copy.copy(maker)
+            maker.selection = [_ for _ in maker.selection if _ not in irf_selection]
+
+        tile_makers.append(maker)
+
+    return tile_makers, irf_selection
+
+
+def _update_mask(mask, other):
+    """Logical or of an aligned cutout mask into a mask, in place"""
+    slices = other.geom.cutout_slices(mask.geom)
+    parent_slices = (Ellipsis,) + tuple(slices["parent-slices"])
+    cutout_slices = (Ellipsis,) + tuple(slices["cutout-slices"])
+    mask.data[parent_slices] |= other.data[cutout_slices]
+
+
+def _stack_irfs(stacked, observation, selection, cutout_width, mask_safe):
+    """Stack the PSF and energy dispersion of an observation
+
+    The IRFs are computed on a cutout of the coarse IRF geometries and
+    weighted by the safe mask of the observation, as in `MapDataset.stack`.
+    """
+    maker = MapDatasetMaker()
+    pointing = observation.pointing_radec
+    irfs = {}
+
+    for name in selection:
+        irf = getattr(stacked, name)
+
+        try:
+            geom = getattr(irf, f"{name}_map").geom.cutout(pointing, width=cutout_width)
+        except NoOverlapError:
+            continue
+
+        if name == "psf":
+            irfs[name] = maker.make_psf(geom, observation)
+        elif isinstance(irf, EDispKernelMap):
+            irfs[name] = maker.make_edisp_kernel(geom, observation)
+        else:
+            irfs[name] = maker.make_edisp(geom, observation)
+
+    other = MapDataset(mask_safe=mask_safe, **irfs)
+
+    if "psf" in irfs:
+        stacked.psf.stack(other.psf, weights=other.mask_safe_psf)
+
+    if "edisp" in irfs:
+        stacked.edisp.stack(other.edisp, weights=other.mask_safe_edisp)
+
+
+def get_offset_mask(geom, pointing, offset_max):
+    """Image mask of pixels with centers closer than offset_max to the pointing"""
+    return geom.to_image().separation(pointing) < offset_max
+
+
+def make_counts_map(geom, observations, offset_max=None):
+    """Bin the events of observations into a counts map
+
+    Fast path for counts-only maps, equivalent to stacking datasets reduced
+    with ``MapDatasetMaker(selection=["counts"])`` and an offset-max
+    `SafeMaskMaker`, but without creating any datasets. The events are
+    binned with a single `numpy.bincount` per observation and summed in
+    place. The offset mask is computed once per pointing position.
+
+    Parameters
+    ----------
+    geom : `~gammapy.maps.WcsGeom`
+        Counts geometry.
+    observations : `~gammapy.data.Observations`
+        Observations.
+    offset_max : `~astropy.coordinates.Angle`
+        Maximum offset of the pixel centers from the pointing position.
+
+    Returns
+    -------
+    counts : `~gammapy.maps.WcsNDMap`
+        Counts map.
+    """
+    counts = Map.from_geom(geom)
+    data = counts.data.reshape(-1)
+    masks = {}
+
+    for observation in observations:
+        idx = geom.coord_to_idx(observation.events.map_coord(geom))
+        valid = np.all([_ >= 0 for _ in idx], axis=0)
+
+        if offset_max is not None:
+            pointing = observation.pointing_radec.icrs
+            key = (pointing.ra.deg, pointing.dec.deg)
+
+            if key not in masks:
+                masks[key] = get_offset_mask(geom, pointing, Angle(offset_max))
+
+            valid[valid] = masks[key][idx[1][valid], idx[0][valid]]
+
+        # idx is ordered (lon, lat, ...), the data axes are reversed
+        flat_idx = np.ravel_multi_index(
+            [_[valid] for _ in idx[::-1]], dims=geom.data_shape
+        )
+        data += np.bincount(flat_idx, minlength=data.size).astype(data.dtype)
+
+    return counts
+
+
+def make_stacked_dataset_tiled(
+    stacked, observations, makers, cutout_width, tile_size=100, dtype=None
+):
+    """Reduce observations and stack them tile by tile
+
+    The stacked geometry is split into spatial tiles. For each tile, the
+    cutouts of all overlapping observations are reduced and stacked onto an
+    in-memory tile dataset, which is then written to the corresponding
+    slice of ``stacked``. Together with a dataset created by
+    `create_memmap_dataset`, the peak memory is bounded by the tile size and
+    the cutout width, independent of the size of the stacked geometry.
+
+    The PSF and energy dispersion maps are binned coarsely and are stacked
+    once per observation instead of per tile, weighted by the safe mask of
+    the observation collected from all tiles. These masks are kept in memory
+    as boolean cubes of the cutout size, one per observation.
+
+    Parameters
+    ----------
+    stacked : `~gammapy.datasets.MapDataset`
+        Empty dataset defining the stacked geometry, e.g. created by
+        `create_memmap_dataset`.
+    observations : `~gammapy.data.Observations`
+        Observations to reduce.
+    makers : list
+        Makers with a ``run(dataset, observation)`` method, applied in order.
+    cutout_width : `~astropy.coordinates.Angle`
+        Width of the cutout around the pointing position of each observation.
+    tile_size : int
+        Maximum width and height of a tile in pixels.
+    dtype : `~numpy.dtype`
+        If given, cast the reduced tiles to this data type. It should match
+        the data type of ``stacked``, see `create_memmap_dataset`.
+
+    Returns
+    -------
+    stacked : `~gammapy.datasets.MapDataset`
+        Stacked dataset.
+    """
+    observations = list(observations)
+    cutout_width = Angle(cutout_width)
+    tile_makers, irf_selection = _split_irf_makers(makers)
+    masks = {}
+
+    for observation in observations:
+        try:
+            geom = stacked.counts.geom.cutout(
+                observation.pointing_radec, width=cutout_width
+            )
+        except NoOverlapError:
+            continue
+
+        masks[observation.obs_id] = Map.from_geom(geom, dtype=bool)
+
+    names = ["counts", "background", "exposure", "mask_safe"]
+    used = set()
+
+    for slices, geom in iter_tiles(stacked.counts.geom, tile_size=tile_size):
+        tile = _create_tile_dataset(stacked, geom)
+
+        for observation in observations:
+            try:
+                dataset = reduce_observation(
+                    tile,
+                    observation,
+                    makers=tile_makers,
+                    cutout_width=cutout_width,
+                    dtype=dtype,
+                )
+            except NoOverlapError:
+                continue
+
+            tile.stack(dataset)
+            _update_mask(masks[observation.obs_id], dataset.mask_safe)
+            used.add(observation.obs_id)
+
+        for name in names:
+            getattr(stacked, name).data[(Ellipsis,) + slices] = getattr(tile, name).data
+
+        log.info(f"Stacked tile {slices} of {stacked.name}")
+
+    for observation in observations:
+        if observation.obs_id in used:
+            mask_safe = masks[observation.obs_id]
+            _stack_irfs(stacked, observation, irf_selection, cutout_width, mask_safe)
+
+    gtis = [obs.gti for obs in observations if obs.obs_id in used]
+
+    if gtis:
+        stacked.gti = GTI.from_stack(gtis).union()
+
+    return stacked
@@ -0,0 +1,165 @@
+"""Single file bulk container for collections of datasets
+
+`~gammapy.datasets.Datasets.write` writes one FITS file per dataset plus a
+YAML index, so reading a single dataset from a large collection is
+dominated by per-file overhead. The bulk container concatenates the FITS
+serialisation of all datasets into one file, followed by a JSON table of
+contents and a fixed size trailer::
+
+    [FITS bytes of dataset 0][FITS bytes of dataset 1]...[TOC JSON][trailer]
+
+The trailer holds the size of the table of contents and a magic string.
+`BulkDatasets` memory maps the file and decodes single datasets on demand,
+so reading one dataset does not depend on the size of the collection.
+Only the bytes of the requested dataset are copied out of the memory map,
+the returned datasets are writable and independent of the file.
+"""
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+from pathlib import Path
+
+from astropy.io import fits
+from gammapy.datasets import DATASET_REGISTRY, Datasets
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"GPBULK01"
+TRAILER = struct.Struct("<Q8s")
+
+
+def write_datasets_bulk(datasets, filename, overwrite=False):
+    """Write datasets to a single bulk container file
+
+    Parameters
+    ----------
+    datasets : `~gammapy.datasets.Datasets`
+        Datasets implementing ``to_hdulist``.
+    filename : `~pathlib.Path`
+        Output file.
+    overwrite : bool
+        Overwrite existing file.
+    """
+    filename = Path(filename)
+
+    if filename.exists() and not overwrite:
+        raise IOError(f"File exists already: {filename}")
+
+    tmp = filename.with_name(f"{filename.name}.{os.getpid()}")
+    toc = []
+
+    with tmp.open("wb") as fh:
+        for dataset in Datasets(datasets):
+            # astropy refuses to write to a non-empty file object
+            buffer = io.BytesIO()
+            dataset.to_hdulist().writeto(buffer)
+
+            offset = fh.tell()
+            fh.write(buffer.getbuffer())
+            toc.append(
+                {
+                    "name": dataset.name,
+                    "tag": dataset.tag,
+                    "offset": offset,
+                    "size": fh.tell() - offset,
+                }
+            )
+
+        data = json.dumps({"datasets": toc}).encode()
+        fh.write(data)
+        fh.write(TRAILER.pack(len(data), MAGIC))
+
+    os.replace(tmp, filename)
+
+
+class BulkDatasets:
+    """Lazy reader of a bulk datasets container
+
+    Parameters
+    ----------
+    filename : `~pathlib.Path`
+        Bulk container file.
+
+    Examples
+    --------
+    >>> with BulkDatasets("datasets.bulk") as bulk:
+    ...     dataset = bulk["obs-110380"]
+    ...     datasets = bulk.read()
+    """
+
+    def __init__(self, filename):
+        self.filename = Path(filename)
+
+        with self.filename.open("rb") as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        toc_size, magic = TRAILER.unpack(self._mmap[-TRAILER.size :])
+
+        if magic != MAGIC:
+            raise ValueError(f"Not a bulk datasets file: {filename}")
+
+        stop = len(self._mmap) - TRAILER.size
+        toc = json.loads(self._mmap[stop - toc_size : stop])
+        self._toc = {entry["name"]: entry for entry in toc["datasets"]}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the memory map, datasets read before stay valid"""
+        self._mmap.close()
+
+    @property
+    def names(self):
+        return list(self._toc)
+
+    def __len__(self):
+        return len(self._toc)
+
+    def __contains__(self, name):
+        return name in self._toc
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            key = self.names[key]
+
+        entry = self._toc[key]
+        cls = DATASET_REGISTRY.get_cls(entry["tag"])
+
+        # copy only the bytes of this dataset, reading from a file object
+        # gives writable arrays, unlike `fits.HDUList.fromstring`
+        start = entry["offset"]
+
+        with memoryview(self._mmap)[start : start + entry["size"]] as view:
+            fileobj = io.BytesIO(view)
+
+        with fits.open(fileobj) as hdulist:
+            return cls.from_hdulist(hdulist, name=entry["name"])
+
+    def read(self, names=None):
+        """Read datasets
+
+        Parameters
+        ----------
+        names : list of str
+            Dataset names, by default all datasets.
+
+        Returns
+        -------
+        datasets : `~gammapy.datasets.Datasets`
+            Datasets.
+        """
+        names = self.names if names is None else names
+        return Datasets([self[name] for name in names])
+
+
+def read_datasets_bulk(filename, names=None):
+    """Read datasets from a bulk container file, see `BulkDatasets.read`"""
+    with BulkDatasets(filename) as bulk:
+        return bulk.read(names=names)
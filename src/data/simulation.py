@@ -0,0 +1,157 @@
+"""Batched Poisson simulation of counts for Monte Carlo studies
+
+`~gammapy.datasets.MapDataset.fake` evaluates the model prediction and draws
+a single realisation per call. The functions in this module evaluate
+``npred`` once and draw many realisations from it, either as a single
+``(n_realisations, energy, lat, lon)`` array or in memory bounded chunks.
+
+Realisation ``idx`` is always drawn from a generator seeded with the child
+``idx`` of ``np.random.SeedSequence(seed)``, so each realisation can be
+reproduced on its own, independent of the chunk size.
+"""
+import logging
+
+import numpy as np
+from gammapy.maps import Map
+
+log = logging.getLogger(__name__)
+
+
+def get_realisation_rng(seed, idx):
+    """Random number generator of a single realisation
+
+    Parameters
+    ----------
+    seed : int
+        Seed of the whole batch.
+    idx : int
+        Index of the realisation.
+
+    Returns
+    -------
+    rng : `~numpy.random.Generator`
+        Generator, equivalent to ``np.random.SeedSequence(seed).spawn(idx + 1)[idx]``.
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(idx,)))
+
+
+def iter_poisson_realisations(
+    npred, n_realisations, seed=0, chunk_size=16, dtype=np.int32
+):
+    """Iterate over chunks of Poisson realisations of a given expectation
+
+    Parameters
+    ----------
+    npred : `~numpy.ndarray`
+        Expected counts. Non-finite values are replaced by zero.
+    n_realisations : int
+        Total number of realisations.
+    seed : int
+        Seed of the batch.
+    chunk_size : int
+        Maximum number of realisations per chunk.
+    dtype : `~numpy.dtype`
+        Data type of the counts.
+
+    Yields
+    ------
+    start : int
+        Index of the first realisation in the chunk.
+    counts : `~numpy.ndarray`
+        Counts with shape ``(n_chunk,) + npred.shape``.
+    """
+    # same as `MapDataset.fake`, e.g. for NaN background outside the safe mask
+    npred = np.nan_to_num(npred, copy=True, nan=0.0, posinf=0.0, neginf=0.0)
+
+    for start in range(0, n_realisations, chunk_size):
+        stop = min(start + chunk_size, n_realisations)
+        counts = np.empty((stop - start,) + npred.shape, dtype=dtype)
+
+        for idx in range(start, stop):
+            rng = get_realisation_rng(seed, idx)
+            counts[idx - start] = rng.poisson(npred)
+
+        yield start, counts
+
+
+def iter_simulated_counts(dataset, n_realisations, seed=0, chunk_size=16):
+    """Iterate over chunks of simulated counts of a dataset
+
+    The model prediction of the dataset is evaluated only once.
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.MapDataset`
+        Dataset with models.
+    n_realisations : int
+        Total number of realisations.
+    seed : int
+        Seed of the batch.
+    chunk_size : int
+        Maximum number of realisations per chunk, limits the memory use to
+        ``chunk_size`` times the size of the counts cube.
+
+    Yields
+    ------
+    start : int
+        Index of the first realisation in the chunk.
+    counts : `~numpy.ndarray`
+        Counts with shape ``(n_chunk, energy, lat, lon)``.
+    """
+    npred = dataset.npred()
+    log.info(
+        f"Simulating {n_realisations} realisations of {dataset.name} "
+        f"with total npred={npred.data.sum():.1f}"
+    )
+    yield from iter_poisson_realisations(
+        npred.data, n_realisations=n_realisations, seed=seed, chunk_size=chunk_size
+    )
+
+
+def simulate_counts_batch(dataset, n_realisations, seed=0):
+    """Simulate counts of a dataset for many realisations at once
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.MapDataset`
+        Dataset with models.
+    n_realisations : int
+        Number of realisations.
+    seed : int
+        Seed of the batch.
+
+    Returns
+    -------
+    counts : `~numpy.ndarray`
+        Counts with shape ``(n_realisations, energy, lat, lon)``.
+    """
+    shape = (n_realisations,) + dataset.counts.geom.data_shape
+    counts = np.empty(shape, dtype=np.int32)
+
+    if n_realisations == 0:
+        return counts
+
+    chunks = iter_simulated_counts(dataset, n_realisations=n_realisations, seed=seed)
+
+    for start, chunk in chunks:
+        counts[start : start + len(chunk)] = chunk
+
+    return counts
+
+
+def get_realisation_counts(dataset, counts):
+    """Wrap the counts of a single realisation into a map of the dataset geometry
+
+    Parameters
+    ----------
+    dataset : `~gammapy.datasets.MapDataset`
+        Dataset.
+    counts : `~numpy.ndarray`
+        Counts of a single realisation.
+
+    Returns
+    -------
+    counts : `~gammapy.maps.Map`
+        Counts map.
+    """
+    return Map.from_geom(dataset.counts.geom, data=counts.astype(float))
@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+PATH = Path(__file__).parent.parent
+
+# the scripts and the shared data preparation modules are not packages
+sys.path.insert(0, str(PATH / "scripts"))
+sys.path.insert(0, str(PATH / "src/data"))
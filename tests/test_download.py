@@ -0,0 +1,211 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import download
+
+DATA = bytes(range(256)) * 64
+
+
+class Progress:
+    def __init__(self):
+        self.total = 0
+        self.n_bytes = 0
+        self.n_done = 0
+
+    def add_total(self, size):
+        self.total += size
+
+    def update(self, size):
+        self.n_bytes += size
+
+    def file_done(self):
+        self.n_done += 1
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves ``DATA`` with range support, misbehaving as configured"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        config = self.server.config
+        config["ranges"].append(self.headers.get("Range"))
+
+        offset = 0
+        status = 200
+
+        if self.headers.get("Range") and not config["ignore_range"]:
+            offset = int(self.headers["Range"][len("bytes=") : -1])
+            status = 206
+
+        if offset >= len(DATA):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(DATA)}")
+            self.end_headers()
+            return
+
+        # respond with shorter, but valid, ranges
+        stop = len(DATA)
+
+        if config["max_size"] is not None:
+            stop = min(stop, offset + config["max_size"])
+            status = 206
+
+        body = DATA[offset:stop]
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {offset}-{stop - 1}/{len(DATA)}")
+
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture()
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.config = {"ranges": [], "ignore_range": False, "max_size": None}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def url(server):
+    host, port = server.server_address
+    return f"http://{host}:{port}/"
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(download.time, "sleep", lambda _: None)
+
+
+def test_download_file(url, tmp_path):
+    destination = tmp_path / "file.fits"
+    progress = Progress()
+
+    download.download_file(url + "file.fits", destination, progress)
+
+    assert destination.read_bytes() == DATA
+    assert not destination.with_name("file.fits.part").exists()
+    assert progress.total == progress.n_bytes == len(DATA)
+
+
+def test_download_file_resume(server, url, tmp_path):
+    destination = tmp_path / "file.fits"
+    destination.with_name("file.fits.part").write_bytes(DATA[:1000])
+    progress = Progress()
+
+    download.download_file(url + "file.fits", destination, progress)
+
+    assert destination.read_bytes() == DATA
+    assert server.config["ranges"] == ["bytes=1000-"]
+    assert progress.n_bytes == len(DATA)
+
+
+def test_download_file_short_responses(server, url, tmp_path):
+    server.config["max_size"] = 5000
+    destination = tmp_path / "file.fits"
+    progress = Progress()
+
+    download.download_file(url + "file.fits", destination, progress, retries=5)
+
+    assert destination.read_bytes() == DATA
+    ranges = [None, "bytes=5000-", "bytes=10000-", "bytes=15000-"]
+    assert server.config["ranges"] == ranges
+    assert progress.total == progress.n_bytes == len(DATA)
+
+
+def test_download_file_incomplete(server, url, tmp_path):
+    server.config["max_size"] = 5000
+    destination = tmp_path / "file.fits"
+
+    with pytest.raises(requests.ConnectionError, match="Incomplete download"):
+        download.download_file(url + "file.fits", destination, Progress(), retries=1)
+
+    assert not destination.exists()
+    assert destination.with_name("file.fits.part").stat().st_size == 10000
+
+
+def test_download_file_range_ignored(server, url, tmp_path):
+    server.config["ignore_range"] = True
+    destination = tmp_path / "file.fits"
+    destination.with_name("file.fits.part").write_bytes(b"invalid")
+    progress = Progress()
+
+    download.download_file(url + "file.fits", destination, progress)
+
+    assert destination.read_bytes() == DATA
+    assert progress.total == progress.n_bytes == len(DATA)
+
+
+def test_http_source_fetch_files(url, tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "PATH_DATA", tmp_path)
+    filenames = ["a/file-1.fits", "b/file-2.fits"]
+    done, progress = [], Progress()
+
+    source = download.get_source(url)
+    source.fetch_files(filenames, progress=progress, n_jobs=2, on_done=done.append)
+
+    assert sorted(done) == filenames
+    assert progress.n_done == 2
+
+    for filename in filenames:
+        assert (tmp_path / filename).read_bytes() == DATA
+
+
+@pytest.fixture()
+def data_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "PATH_DATA", tmp_path)
+    checksum_cache = download.ChecksumCache
+    path = tmp_path / ".checksums"
+    monkeypatch.setattr(download, "ChecksumCache", lambda: checksum_cache(path))
+    return tmp_path
+
+
+def test_verify_data_files(data_path):
+    tmp_path = data_path
+    (tmp_path / "file.fits").write_bytes(DATA)
+    (tmp_path / "other.fits").write_bytes(DATA[:10])
+
+    manifest = {}
+    for name in ["file.fits", "other.fits"]:
+        manifest[name] = {
+            "size": len(DATA),
+            "sha256": download.sha256sum(tmp_path / "file.fits"),
+        }
+
+    invalid = download.verify_data_files(["file.fits", "other.fits"], manifest)
+    assert invalid == ["other.fits"]
+
+    with pytest.raises(ValueError, match="No manifest entry"):
+        download.verify_data_files(["file.fits", "unlisted.fits"], manifest)
+
+
+def test_download_data_files_record(server, url, data_path):
+    filenames = ["a/file-1.fits", "b/file-2.fits"]
+
+    download.download_data_files(filenames, source=url, manifest={})
+    assert len(server.config["ranges"]) == 2
+
+    # unchanged files are not fetched again and verify against their record
+    download.download_data_files(filenames, source=url, manifest={})
+    assert len(server.config["ranges"]) == 2
+    assert download.verify_data_files(filenames, manifest={}) == []
+
+    # corrupt a file, keeping its size and modification time
+    path = data_path / filenames[0]
+    stat = path.stat()
+    path.write_bytes(DATA[::-1])
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert download.verify_data_files(filenames, manifest={}) == filenames[:1]
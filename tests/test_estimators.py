@@ -0,0 +1,141 @@
+import astropy.units as u
+import numpy as np
+from astropy.time import Time
+from gammapy.data import GTI
+from gammapy.datasets import MapDataset, SpectrumDataset
+from gammapy.estimators import (
+    ExcessMapEstimator,
+    FluxPointsEstimator,
+    LightCurveEstimator,
+)
+from gammapy.irf import EDispKernelMap
+from gammapy.maps import MapAxis, RegionGeom, WcsGeom
+from gammapy.modeling.models import (
+    FoVBackgroundModel,
+    GaussianSpatialModel,
+    PowerLawSpectralModel,
+    SkyModel,
+)
+
+from estimators import (
+    ExcessMapContext,
+    ParallelFluxPointsEstimator,
+    ParallelLightCurveEstimator,
+)
+
+TIME_REF = Time("2020-01-01T00:00:00")
+
+
+def get_map_dataset():
+    axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=3)
+    geom = WcsGeom.create(skydir=(0, 0), npix=40, binsz=0.02, axes=[axis])
+    dataset = MapDataset.create(geom, name="test")
+    dataset.background.data += 2.0
+    dataset.exposure.data += 1e12
+
+    random_state = np.random.default_rng(0)
+    dataset.counts.data = random_state.poisson(3.0, geom.data_shape).astype(float)
+
+    # energy dependent safe mask, the lowest energy bin only on one half
+    dataset.mask_safe.data[...] = True
+    dataset.mask_safe.data[0, :, :20] = False
+    dataset.mask_safe.data[:, :5] = False
+
+    spectral_model = PowerLawSpectralModel(amplitude="1e-12 cm-2 s-1 TeV-1")
+    spatial_model = GaussianSpatialModel(lon_0="0 deg", lat_0="0 deg", sigma="0.1 deg")
+    dataset.models = [
+        SkyModel(spectral_model, spatial_model, name="source"),
+        FoVBackgroundModel(dataset_name="test"),
+    ]
+    return dataset
+
+
+def get_spectrum_datasets(n_datasets=2):
+    axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=6)
+    axis_true = MapAxis.from_energy_bounds(
+        "0.5 TeV", "20 TeV", nbin=12, name="energy_true"
+    )
+    geom = RegionGeom.create("icrs;circle(83.63, 22.01, 0.1)", axes=[axis])
+    model = SkyModel(
+        PowerLawSpectralModel(amplitude="1e-11 cm-2 s-1 TeV-1"), name="source"
+    )
+    random_state = np.random.default_rng(0)
+    datasets = []
+
+    for idx in range(n_datasets):
+        dataset = SpectrumDataset.create(
+            geom, energy_axis_true=axis_true, name=f"test-{idx}"
+        )
+        dataset.mask_safe.data[...] = True
+        dataset.exposure.data += 1e10
+        dataset.background.data += 5.0
+        dataset.edisp = EDispKernelMap.from_diagonal_response(
+            axis, axis_true, geom=geom.to_image()
+        )
+        dataset.gti = GTI.create(
+            [idx] * u.h, [idx + 0.5] * u.h, reference_time=TIME_REF
+        )
+        dataset.models = [model]
+        npred = dataset.npred().data
+        dataset.counts.data = random_state.poisson(npred).astype(float)
+        datasets.append(dataset)
+
+    return datasets
+
+
+def test_excess_map_context():
+    dataset = get_map_dataset()
+
+    context = ExcessMapContext(dataset, correlation_radius="0.1 deg")
+    result = context.run(dataset)
+
+    estimator = ExcessMapEstimator(correlation_radius="0.1 deg")
+    expected = estimator.run(dataset)
+
+    np.testing.assert_allclose(
+        result["excess"].data,
+        expected["npred_excess"].data,
+        atol=1e-3,
+        equal_nan=True,
+    )
+    # sqrt_ts amplifies the FFT noise where the excess is close to zero
+    np.testing.assert_allclose(
+        result["sqrt_ts"].data, expected["sqrt_ts"].data, atol=1e-2, equal_nan=True
+    )
+
+
+def test_parallel_flux_points_estimator():
+    datasets = get_spectrum_datasets()
+    energy_edges = [1, 2, 5, 10] * u.TeV
+
+    estimator = FluxPointsEstimator(energy_edges=energy_edges, source="source")
+    expected = estimator.run(datasets)
+
+    estimator = ParallelFluxPointsEstimator(
+        n_jobs=2, energy_edges=energy_edges, source="source"
+    )
+    result = estimator.run(datasets)
+
+    for name in ["norm", "norm_err", "ts", "counts", "npred"]:
+        np.testing.assert_allclose(
+            getattr(result, name).data, getattr(expected, name).data, rtol=1e-6
+        )
+
+
+def test_parallel_light_curve_estimator():
+    datasets = get_spectrum_datasets(n_datasets=3)
+    time_intervals = [TIME_REF + [0, 1.5] * u.h, TIME_REF + [1.5, 3] * u.h]
+    kwargs = dict(
+        energy_edges=[1, 10] * u.TeV, time_intervals=time_intervals, source="source"
+    )
+
+    expected = LightCurveEstimator(**kwargs).run(datasets)
+    result = ParallelLightCurveEstimator(n_jobs=2, **kwargs).run(datasets)
+
+    time_axis = result.geom.axes["time"]
+    assert np.all(time_axis.time_min == expected.geom.axes["time"].time_min)
+
+    for name in ["norm", "norm_err", "ts", "counts", "npred"]:
+        np.testing.assert_allclose(
+            getattr(result, name).data, getattr(expected, name).data, rtol=1e-6
+        )
@@ -0,0 +1,25 @@
+import numpy as np
+from gammapy.maps import Map, WcsGeom
+
+import fitscache
+
+
+def test_read(tmp_path, monkeypatch):
+    filename = tmp_path / "map.fits.gz"
+    m = Map.from_geom(WcsGeom.create(npix=(4, 3)))
+    m.data = np.arange(12.0).reshape((3, 4))
+    m.write(filename)
+
+    path_cache = tmp_path / "cache"
+    result = fitscache.read(Map, filename, path_cache=path_cache)
+
+    np.testing.assert_array_equal(result.data, m.data)
+    assert fitscache.get_index_filename(filename, path_cache).exists()
+
+    # the checksum is taken from the index entry
+    def sha256sum(filename):
+        raise AssertionError("checksum computed again")
+
+    monkeypatch.setattr(fitscache, "sha256sum", sha256sum)
+    cached = fitscache.decompress(filename, path_cache=path_cache)
+    assert cached.name.endswith("-map.fits")
@@ -0,0 +1,110 @@
+import numpy as np
+from gammapy.datasets import MapDataset, SpectrumDataset
+from gammapy.irf import EDispKernelMap
+from gammapy.maps import MapAxis, RegionGeom, WcsGeom
+from gammapy.modeling.models import (
+    FoVBackgroundModel,
+    GaussianSpatialModel,
+    PointSpatialModel,
+    PowerLawSpectralModel,
+    SkyModel,
+)
+
+from modeling import FitCheckpoint, npred_contributions, run_fit
+
+
+def get_dataset(name="test"):
+    axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=2)
+    geom = WcsGeom.create(skydir=(0, 0), width=0.5, binsz=0.1, axes=[axis])
+    dataset = MapDataset.create(geom, name=name)
+    dataset.background.data += 10.0
+    dataset.counts.data += 12.0
+    dataset.mask_safe.data[...] = True
+    dataset.models = [FoVBackgroundModel(dataset_name=name)]
+    return dataset
+
+
+def write_interrupted(dataset, filename, norm):
+    checkpoint = FitCheckpoint([dataset], filename=filename)
+    dataset.models[0].spectral_model.norm.value = norm
+    checkpoint.write(status="interrupted")
+
+
+def test_run_fit_removes_checkpoint(tmp_path):
+    filename = tmp_path / "checkpoint.json"
+    dataset = get_dataset()
+
+    result = run_fit([dataset], checkpoint=filename, every=1)
+
+    assert result.success
+    assert not filename.exists()
+    norm = dataset.models[0].spectral_model.norm.value
+    np.testing.assert_allclose(norm, 1.2, rtol=1e-3)
+
+
+def test_checkpoint_resume(tmp_path):
+    filename = tmp_path / "checkpoint.json"
+    write_interrupted(get_dataset(), filename, norm=1.5)
+
+    dataset = get_dataset()
+    checkpoint = FitCheckpoint([dataset], filename=filename)
+
+    assert checkpoint.resume()
+    assert dataset.models[0].spectral_model.norm.value == 1.5
+
+
+def test_checkpoint_resume_mismatch(tmp_path):
+    filename = tmp_path / "checkpoint.json"
+    write_interrupted(get_dataset(name="other"), filename, norm=1.5)
+
+    dataset = get_dataset()
+    dataset.models[0].spectral_model.tilt.frozen = False
+    checkpoint = FitCheckpoint([dataset], filename=filename)
+
+    assert not checkpoint.resume()
+    assert dataset.models[0].spectral_model.norm.value == 1.0
+
+
+def get_spectrum_dataset():
+    axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=3)
+    axis_true = MapAxis.from_energy_bounds(
+        "0.5 TeV", "20 TeV", nbin=6, name="energy_true"
+    )
+    geom = RegionGeom.create("galactic;circle(0, 0, 0.2)", axes=[axis])
+    dataset = SpectrumDataset.create(geom, energy_axis_true=axis_true, name="test")
+    dataset.mask_safe.data[...] = True
+    dataset.exposure.data += np.linspace(1e11, 1e12, 6).reshape((6, 1, 1))
+    dataset.edisp = EDispKernelMap.from_gauss(
+        axis, axis_true, sigma=0.2, bias=0.05, geom=geom.to_image()
+    )
+    return dataset
+
+
+def test_npred_contributions():
+    dataset = get_spectrum_dataset()
+    models = [
+        SkyModel(
+            PowerLawSpectralModel(amplitude="1e-12 cm-2 s-1 TeV-1"),
+            PointSpatialModel(lon_0="0.05 deg", lat_0="0 deg", frame="galactic"),
+            name="point",
+        ),
+        SkyModel(
+            PowerLawSpectralModel(index=2.5, amplitude="2e-12 cm-2 s-1 TeV-1"),
+            GaussianSpatialModel(
+                lon_0="0.1 deg", lat_0="0 deg", sigma="0.2 deg", frame="galactic"
+            ),
+            name="gauss",
+        ),
+    ]
+
+    result = npred_contributions(dataset, models)
+
+    for model, npred in zip(models, result):
+        dataset.models = [SkyModel(model.spectral_model.copy(), name=model.name)]
+        expected = dataset.npred_signal().data
+
+        if model.name == "gauss":
+            geom = dataset.counts.geom
+            expected = expected * model.spatial_model.integrate_geom(geom).data
+
+        np.testing.assert_allclose(npred.data, expected, rtol=1e-6)
@@ -0,0 +1,52 @@
+import astropy.units as u
+import numpy as np
+from astropy.table import Table
+from astropy.time import Time
+from gammapy.data import GTI, EventList, Observation, Observations
+from gammapy.utils.time import time_ref_to_dict
+
+from observations import split_observations_by_time
+
+TIME_REF = Time("2020-01-01T00:00:00")
+
+
+def make_observation(obs_id, time_start, random_state):
+    n_events = 100
+    time = random_state.uniform(time_start, time_start + 3600, n_events)
+    table = Table(
+        {
+            "TIME": time * u.s,
+            "ENERGY": np.ones(n_events) * u.TeV,
+            "RA": np.ones(n_events) * u.deg,
+            "DEC": np.ones(n_events) * u.deg,
+        },
+        meta=time_ref_to_dict(TIME_REF),
+    )
+    gti = GTI.create(
+        [time_start] * u.s, [time_start + 3600] * u.s, reference_time=TIME_REF
+    )
+    return Observation(obs_id=obs_id, events=EventList(table), gti=gti)
+
+
+def test_split_observations_by_time():
+    random_state = np.random.default_rng(0)
+    observations = Observations(
+        [
+            make_observation(1, 0, random_state),
+            make_observation(2, 1800, random_state),
+        ]
+    )
+    time_intervals = [
+        TIME_REF + [0, 1200] * u.s,
+        TIME_REF + [1200, 2400] * u.s,
+        TIME_REF + [2400, 6000] * u.s,
+    ]
+
+    expected = observations.select_time(time_intervals)
+    result = split_observations_by_time(observations, time_intervals)
+
+    assert [obs.obs_id for obs in result] == [obs.obs_id for obs in expected]
+
+    for obs, obs_expected in zip(result, expected):
+        assert len(obs.events.table) == len(obs_expected.events.table)
+        assert np.all(obs.gti.time_start == obs_expected.gti.time_start)
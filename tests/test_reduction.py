@@ -0,0 +1,338 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import astropy.units as u
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
+from astropy.table import Table
+from astropy.time import Time
+from gammapy.data import EventList, Observation
+from gammapy.datasets import MapDataset, SpectrumDataset
+from gammapy.irf import Background3D, EffectiveAreaTable2D, EnergyDispersion2D, PSF3D
+from gammapy.makers import (
+    FoVBackgroundMaker,
+    MapDatasetMaker,
+    ReflectedRegionsBackgroundMaker,
+    ReflectedRegionsFinder,
+    SafeMaskMaker,
+    SpectrumDatasetMaker,
+)
+from gammapy.maps import MapAxis, RegionGeom, WcsGeom
+from gammapy.utils.fits import HDULocation
+from gammapy.utils.time import time_ref_to_dict
+from regions import CircleSkyRegion
+
+from conftest import PATH
+from reduction import (
+    CachedRegionsFinder,
+    CachedSpectrumDatasetMaker,
+    ReducedDatasetCache,
+    create_memmap_dataset,
+    make_stacked_dataset,
+    make_stacked_dataset_tiled,
+    resolve_off_regions,
+)
+
+TIME_REF = Time("2020-01-01T00:00:00")
+
+ENERGY_AXIS = MapAxis.from_energy_bounds("0.5 TeV", "20 TeV", nbin=3)
+
+ENERGY_AXIS_TRUE = MapAxis.from_energy_bounds(
+    "0.3 TeV", "30 TeV", nbin=6, name="energy_true"
+)
+
+SCRIPT_KEY = """
+import astropy.units as u
+from astropy.coordinates import SkyCoord
+from gammapy.data import Observation
+from gammapy.datasets import MapDataset
+from gammapy.makers import MapDatasetMaker, SafeMaskMaker
+from gammapy.maps import MapAxis, WcsGeom
+from reduction import ReducedDatasetCache
+
+pointing = SkyCoord(0, 0, unit="deg", frame="galactic")
+axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=3)
+geom = WcsGeom.create(skydir=pointing, width=1, binsz=0.1, axes=[axis])
+observation = Observation.create(pointing=pointing, livetime=1 * u.h, irfs={}, obs_id=1)
+makers = [
+    MapDatasetMaker(selection=["counts", "exposure", "background", "psf", "edisp"]),
+    SafeMaskMaker(methods=["offset-max", "aeff-default", "edisp-bias"]),
+]
+dataset = MapDataset.create(geom)
+print(ReducedDatasetCache().key(dataset, observation, makers, cutout_width="1 deg"))
+"""
+
+
+@pytest.fixture()
+def dataset():
+    axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=3)
+    geom = WcsGeom.create(skydir=(0, 0), width=1, binsz=0.1, axes=[axis])
+    return MapDataset.create(geom)
+
+
+@pytest.fixture()
+def observation(tmp_path):
+    pointing = SkyCoord(0, 0, unit="deg", frame="galactic")
+    observation = Observation.create(
+        pointing=pointing, livetime=1 * u.h, irfs={}, obs_id=1
+    )
+    (tmp_path / "events.fits").write_bytes(b"events")
+    observation._events = HDULocation(
+        hdu_class="events",
+        base_dir=tmp_path,
+        file_dir=".",
+        file_name="events.fits",
+        hdu_name="EVENTS",
+    )
+    return observation
+
+
+def make_irfs():
+    """Simple full enclosure IRFs, effective area rising with energy"""
+    offset_axis = MapAxis.from_bounds(0, 3, nbin=3, unit="deg", name="offset")
+    migra_axis = MapAxis.from_bounds(0.2, 5, nbin=20, name="migra")
+    rad_axis = MapAxis.from_bounds(0, 1, nbin=20, unit="deg", name="rad")
+    fov_lon_axis = MapAxis.from_bounds(-4, 4, nbin=8, unit="deg", name="fov_lon")
+    fov_lat_axis = fov_lon_axis.copy(name="fov_lat")
+    energy_axis = ENERGY_AXIS_TRUE.copy(name="energy")
+
+    aeff = np.array([1e3, 1e4, 3e4, 6e4, 8e4, 1e5])[:, np.newaxis] * np.ones(3)
+
+    sigma = 0.1 * u.deg
+    psf = np.exp(-0.5 * (rad_axis.center / sigma) ** 2) / (2 * np.pi * sigma**2)
+    psf = np.broadcast_to(psf.to_value("sr-1"), (6, 3, 20))
+
+    return {
+        "aeff": EffectiveAreaTable2D(
+            axes=[ENERGY_AXIS_TRUE, offset_axis], data=aeff, unit="m2"
+        ),
+        "edisp": EnergyDispersion2D.from_gauss(
+            ENERGY_AXIS_TRUE, migra_axis, offset_axis, bias=0, sigma=0.1
+        ),
+        "psf": PSF3D(
+            axes=[ENERGY_AXIS_TRUE, offset_axis, rad_axis], data=psf, unit="sr-1"
+        ),
+        "bkg": Background3D(
+            axes=[energy_axis, fov_lon_axis, fov_lat_axis],
+            data=np.full((6, 8, 8), 1e-6),
+            unit="MeV-1 s-1 sr-1",
+        ),
+    }
+
+
+def make_observation(obs_id, pointing, n_events=1000):
+    """Observation of one hour with IRFs and random events around the pointing"""
+    livetime = 1 * u.h
+    observation = Observation.create(
+        pointing,
+        livetime=livetime,
+        tstart=0 * u.h,
+        irfs=make_irfs(),
+        reference_time=TIME_REF,
+        obs_id=obs_id,
+    )
+
+    random_state = np.random.default_rng(obs_id)
+    pointing = pointing.icrs
+    time = random_state.uniform(0, livetime.to_value("s"), n_events)
+    table = Table(
+        {
+            "TIME": np.sort(time) * u.s,
+            "ENERGY": 10 ** random_state.uniform(-0.3, 1.3, n_events) * u.TeV,
+            "RA": (pointing.ra.deg + random_state.normal(0, 1, n_events)) * u.deg,
+            "DEC": (pointing.dec.deg + random_state.normal(0, 1, n_events)) * u.deg,
+        },
+        meta=time_ref_to_dict(TIME_REF),
+    )
+    observation._events = EventList(table)
+    return observation
+
+
+@pytest.fixture(scope="module")
+def observations():
+    return [
+        make_observation(obs_id, SkyCoord(lon, 0, unit="deg", frame="galactic"))
+        for obs_id, lon in enumerate([-0.5, 0.3, 0.6], start=1)
+    ]
+
+
+def get_stacked_empty():
+    geom = WcsGeom.create(
+        skydir=(0, 0), width=3, binsz=0.1, frame="galactic", axes=[ENERGY_AXIS]
+    )
+    return MapDataset.create(
+        geom, energy_axis_true=ENERGY_AXIS_TRUE, binsz_irf=0.5, name="stacked"
+    )
+
+
+def get_map_makers():
+    return [
+        MapDatasetMaker(),
+        SafeMaskMaker(
+            methods=["offset-max", "aeff-max"], offset_max="1.2 deg", aeff_percent=10
+        ),
+    ]
+
+
+def stack_reference(stacked, observations, makers, cutout_width):
+    """Serial reduction and stacking of cutouts, as in the gammapy docs"""
+    stacked = stacked.copy(name="reference")
+
+    for observation in observations:
+        dataset = stacked.cutout(observation.pointing_radec, width=cutout_width)
+
+        for maker in makers:
+            dataset = maker.run(dataset, observation)
+
+        stacked.stack(dataset)
+
+    return stacked
+
+
+def assert_stacked_close(result, expected):
+    # the partial stacks are summed in a different order, float32 precision
+    kwargs = dict(rtol=1e-5, atol=1e-12)
+    np.testing.assert_array_equal(result.mask_safe.data, expected.mask_safe.data)
+    np.testing.assert_allclose(result.counts.data, expected.counts.data)
+    np.testing.assert_allclose(
+        result.background.data, expected.background.data, **kwargs
+    )
+    np.testing.assert_allclose(result.exposure.data, expected.exposure.data, **kwargs)
+    np.testing.assert_allclose(
+        result.psf.psf_map.data, expected.psf.psf_map.data, **kwargs
+    )
+    np.testing.assert_allclose(
+        result.edisp.edisp_map.data, expected.edisp.edisp_map.data, **kwargs
+    )
+    np.testing.assert_allclose(result.gti.time_sum, expected.gti.time_sum)
+
+
+def get_key(pythonhashseed):
+    env = dict(os.environ)
+    env["PYTHONHASHSEED"] = str(pythonhashseed)
+    env["PYTHONPATH"] = str(PATH / "src/data")
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT_KEY],
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return result.stdout.strip()
+
+
+def test_cache_key_stable_across_processes():
+    keys = {get_key(seed) for seed in range(4)}
+    assert len(keys) == 1
+
+
+def test_cache_key_input_files(dataset, observation, tmp_path):
+    cache = ReducedDatasetCache(path=tmp_path / "cache")
+    makers = [MapDatasetMaker(), SafeMaskMaker(methods=["offset-max"])]
+
+    key = cache.key(dataset, observation, makers)
+    assert cache.key(dataset, observation, makers) == key
+
+    (tmp_path / "events.fits").write_bytes(b"modified events")
+    assert cache.key(dataset, observation, makers) != key
+
+
+def test_cache_key_makers(dataset, observation, tmp_path):
+    cache = ReducedDatasetCache(path=tmp_path / "cache")
+
+    key = cache.key(dataset, observation, [SafeMaskMaker(offset_max="2 deg")])
+    key_other = cache.key(dataset, observation, [SafeMaskMaker(offset_max="3 deg")])
+    assert key != key_other
+
+    with pytest.raises(ValueError, match="No cache configuration"):
+        cache.key(dataset, observation, [FoVBackgroundMaker()])
+
+
+def test_resolve_off_regions():
+    target = SkyCoord(83.6, 22.0, unit="deg")
+    axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=2)
+    geom = RegionGeom.create(CircleSkyRegion(target, 0.1 * u.deg), axes=[axis])
+    dataset = SpectrumDataset.create(geom)
+
+    observations = []
+
+    for obs_id, dec in enumerate([22.5, 21.5, 22.5]):
+        pointing = SkyCoord(83.6, dec, unit="deg")
+        observations.append(
+            Observation.create(pointing, livetime=1 * u.h, irfs={}, obs_id=obs_id)
+        )
+
+    finder = CachedRegionsFinder(ReflectedRegionsFinder())
+    maker = ReflectedRegionsBackgroundMaker(region_finder=finder)
+    resolve_off_regions(dataset, observations, [maker])
+
+    assert (finder.misses, finder.hits) == (2, 1)
+
+    # a copy sent to a worker process finds the regions in its cache
+    finder = pickle.loads(pickle.dumps(maker)).region_finder
+    regions, _ = finder.run(geom.region, center=observations[1].pointing_radec)
+
+    assert (finder.misses, finder.hits) == (2, 2)
+    assert len(regions) > 0
+
+
+def test_cached_spectrum_dataset_maker():
+    pointing = SkyCoord(83.6, 22.5, unit="deg")
+    observation = make_observation(1, pointing)
+
+    # the first slice is outside the GTI and has no livetime
+    time_intervals = [[2, 3], [0, 0.25], [0.25, 1]] * u.h
+    slices = [observation.select_time(TIME_REF + _) for _ in time_intervals]
+    assert slices[0].observation_live_time_duration == 0
+
+    region = CircleSkyRegion(SkyCoord(83.6, 22.0, unit="deg"), 0.1 * u.deg)
+    geom = RegionGeom.create(region, axes=[ENERGY_AXIS])
+    dataset = SpectrumDataset.create(geom, energy_axis_true=ENERGY_AXIS_TRUE)
+
+    kwargs = {
+        "selection": ["counts", "exposure", "edisp"],
+        "containment_correction": True,
+    }
+    maker = SpectrumDatasetMaker(**kwargs)
+    maker_cached = CachedSpectrumDatasetMaker(**kwargs)
+
+    for obs in slices:
+        expected = maker.run(dataset.copy(), obs)
+        result = maker_cached.run(dataset.copy(), obs)
+
+        np.testing.assert_array_equal(result.counts.data, expected.counts.data)
+        np.testing.assert_allclose(result.exposure.data, expected.exposure.data)
+        np.testing.assert_allclose(
+            result.edisp.get_edisp_kernel().data,
+            expected.edisp.get_edisp_kernel().data,
+        )
+
+    assert maker_cached.hits == 2
+
+
+def test_make_stacked_dataset(observations):
+    stacked, makers = get_stacked_empty(), get_map_makers()
+    expected = stack_reference(stacked, observations, makers, cutout_width="2 deg")
+
+    result = make_stacked_dataset(
+        stacked, observations, makers=makers, cutout_width="2 deg", n_jobs=2
+    )
+
+    assert_stacked_close(result, expected)
+
+
+def test_make_stacked_dataset_tiled(observations, tmp_path):
+    stacked, makers = get_stacked_empty(), get_map_makers()
+    expected = stack_reference(stacked, observations, makers, cutout_width="2 deg")
+
+    stacked = create_memmap_dataset(
+        stacked.counts.geom, ENERGY_AXIS_TRUE, path=tmp_path, binsz_irf=0.5
+    )
+    result = make_stacked_dataset_tiled(
+        stacked, observations, makers=makers, cutout_width="2 deg", tile_size=10
+    )
+
+    assert_stacked_close(result, expected)
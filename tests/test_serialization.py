@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from astropy.coordinates import SkyCoord
+from gammapy.datasets import MapDataset, SpectrumDatasetOnOff
+from gammapy.maps import MapAxis, RegionGeom, WcsGeom
+
+from serialization import BulkDatasets, read_datasets_bulk, write_datasets_bulk
+
+
+@pytest.fixture()
+def datasets():
+    axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=3)
+    geom = WcsGeom.create(skydir=(0, 0), width=0.5, binsz=0.1, axes=[axis])
+    dataset = MapDataset.create(geom, name="map")
+    dataset.counts.data += 3
+
+    geom = RegionGeom.create("icrs;circle(83.6, 22.0, 0.1)", axes=[axis])
+    on_off = SpectrumDatasetOnOff.create(geom, name="on-off")
+    on_off.counts.data += 2
+    on_off.counts_off.data += np.arange(3).reshape((3, 1, 1))
+    on_off.acceptance.data += 1
+    on_off.acceptance_off.data += 4
+    return [dataset, on_off]
+
+
+def test_bulk_round_trip(datasets, tmp_path):
+    filename = tmp_path / "datasets.bulk"
+    write_datasets_bulk(datasets, filename)
+
+    with pytest.raises(IOError):
+        write_datasets_bulk(datasets, filename)
+
+    result = read_datasets_bulk(filename)
+
+    assert result.names == ["map", "on-off"]
+    assert isinstance(result["on-off"], SpectrumDatasetOnOff)
+    np.testing.assert_array_equal(result["map"].counts.data, 3)
+    np.testing.assert_array_equal(
+        result["on-off"].counts_off.data, datasets[1].counts_off.data
+    )
+    np.testing.assert_array_equal(result["on-off"].acceptance_off.data, 4)
+
+
+def test_bulk_lazy(datasets, tmp_path):
+    filename = tmp_path / "datasets.bulk"
+    write_datasets_bulk(datasets, filename)
+
+    with BulkDatasets(filename) as bulk:
+        assert len(bulk) == 2
+        assert "on-off" in bulk
+        dataset = bulk[1]
+
+    # the dataset is independent of the closed file and writable
+    dataset.counts.data += 1
+    np.testing.assert_array_equal(dataset.counts.data, 3)
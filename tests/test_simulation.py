@@ -0,0 +1,31 @@
+import numpy as np
+from gammapy.datasets import MapDataset
+from gammapy.maps import MapAxis, WcsGeom
+
+from simulation import get_realisation_rng, simulate_counts_batch
+
+
+def get_dataset():
+    axis = MapAxis.from_energy_bounds("1 TeV", "10 TeV", nbin=2)
+    geom = WcsGeom.create(skydir=(0, 0), width=0.5, binsz=0.1, axes=[axis])
+    dataset = MapDataset.create(geom, name="test")
+    dataset.background.data += 10.0
+    dataset.background.data[0, 0, 0] = np.nan
+    return dataset
+
+
+def test_simulate_counts_batch():
+    dataset = get_dataset()
+    counts = simulate_counts_batch(dataset, n_realisations=20, seed=1)
+
+    assert counts.shape == (20, 2, 5, 5)
+    assert np.all(counts[:, 0, 0, 0] == 0)
+
+    rng = get_realisation_rng(seed=1, idx=7)
+    npred = np.nan_to_num(dataset.npred().data)
+    np.testing.assert_array_equal(counts[7], rng.poisson(npred))
+
+
+def test_simulate_counts_batch_empty():
+    counts = simulate_counts_batch(get_dataset(), n_realisations=0)
+    assert counts.shape == (0, 2, 5, 5)